@@ -0,0 +1,167 @@
+# This file is part of Awake - GB decompiler.
+# Copyright (C) 2014  Wojciech Marczenko (devdri) <wojtek.marczenko@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+JSON views of the project database for scripts, served under /api/ next to the html pages:
+
+    /api/procs?cursor=&limit=&fields=   proc summaries in address order, a page at a time
+    /api/proc/<addr>?fields=            summary of one proc
+    /api/data/<addr>                    procs reading and writing a data address
+    /api/bank/<bank>                    cross-bank references of a rom bank
+    /api/names?cursor=&limit=           named addresses
+
+Listings return {"items": [...], "next": cursor}, pass the cursor back to get the next page;
+it is null after the last one. fields is a comma separated subset of PROC_FIELDS.
+"""
+
+from urllib.parse import urlparse, parse_qs
+from awake import address
+from awake.depend import decodeDependencySet
+
+PROC_FIELDS = ('addr', 'name', 'type', 'depset', 'has_switch', 'suspicious_switch', 'has_suspicious_instr', 'has_nop',
+               'has_ambig_calls', 'length', 'calls', 'tail_calls', 'callers', 'memreads', 'memwrites')
+
+FLAG_FIELDS = ('has_switch', 'suspicious_switch', 'has_suspicious_instr', 'has_nop', 'has_ambig_calls')
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+class ApiError(Exception):
+    def __init__(self, status, message):
+        super(ApiError, self).__init__(message)
+        self.status = status
+
+def addressList(addrs):
+    return sorted(str(x) for x in addrs)
+
+def parseAddress(text):
+    try:
+        return address.fromConventional(text)
+    except ValueError:
+        raise ApiError(400, 'bad address: {0}'.format(text))
+
+def parseFields(query):
+    if 'fields' not in query:
+        return PROC_FIELDS
+    fields = query['fields'][0].split(',')
+    unknown = set(fields) - set(PROC_FIELDS)
+    if unknown:
+        raise ApiError(400, 'unknown fields: {0}'.format(', '.join(sorted(unknown))))
+    return fields
+
+def parseLimit(query):
+    try:
+        limit = int(query.get('limit', [DEFAULT_PAGE_SIZE])[0])
+    except ValueError:
+        raise ApiError(400, 'bad limit')
+    return max(1, min(limit, MAX_PAGE_SIZE))
+
+def procSummaries(database, rows, fields):
+    """Summaries of the procs in rows (from Database.getProcRows), reading only the tables the fields need"""
+    if not rows:
+        return []
+    first, last = rows[0][0], rows[-1][0]
+    fields = set(fields)
+
+    # field -> proc addr -> addresses
+    refs = dict((field, dict()) for field in ('calls', 'tail_calls', 'callers', 'memreads', 'memwrites'))
+    if fields & set(['calls', 'tail_calls']):
+        for source, destination, calltype in database.getCallsInRange(first, last):
+            refs['tail_calls' if calltype == 'tail' else 'calls'].setdefault(str(source), set()).add(destination)
+    if 'callers' in fields:
+        for destination, source in database.getCallersInRange(first, last):
+            refs['callers'].setdefault(str(destination), set()).add(source)
+    if fields & set(['memreads', 'memwrites']):
+        for proc, addr, reftype in database.getMemrefsInRange(first, last):
+            refs['memreads' if reftype == 'read' else 'memwrites'].setdefault(str(proc), set()).add(addr)
+
+    out = []
+    for row in rows:
+        addr = str(row[0])
+        values = dict(zip(('addr', 'type', 'depset') + FLAG_FIELDS + ('length',), row))
+        item = dict()
+        for field in PROC_FIELDS:
+            if field not in fields:
+                continue
+            if field == 'addr':
+                item[field] = addr
+            elif field == 'name':
+                item[field] = database.nameForAddress(row[0])
+            elif field == 'depset':
+                depset = decodeDependencySet(values['depset'])
+                item[field] = dict(reads=sorted(depset.reads), writes=sorted(depset.writes))
+            elif field in FLAG_FIELDS:
+                item[field] = bool(values[field])
+            elif field in ('type', 'length'):
+                item[field] = values[field]
+            else:
+                item[field] = addressList(refs[field].get(addr, ()))
+        out.append(item)
+    return out
+
+def listing(items, limit, cursor_of):
+    """Page of a listing queried with limit+1 rows, so a next page is known to exist"""
+    if len(items) > limit:
+        return dict(items=items[:limit], next=cursor_of(items[limit - 1]))
+    return dict(items=items, next=None)
+
+def dispatchApi(proj, url):
+    """
+    JSON-serializable answer for an /api/ url
+    :raises ApiError: for unknown urls and bad parameters
+    """
+    parsed = urlparse(url)
+    query = parse_qs(parsed.query)
+    p = parsed.path.split('/')
+    database = proj.database
+
+    if parsed.path == '/api/procs':
+        limit = parseLimit(query)
+        rows = database.getProcRows(query.get('cursor', [None])[0], limit + 1)
+        page = listing(rows, limit, lambda row: str(row[0]))
+        page['items'] = procSummaries(database, page['items'], parseFields(query))
+        return page
+
+    elif parsed.path.startswith('/api/proc/') and len(p) == 4:
+        addr = parseAddress(p[3])
+        row = database.getProcRow(addr)
+        if row is None:
+            raise ApiError(404, 'no proc at {0}'.format(addr))
+        return procSummaries(database, [row], parseFields(query))[0]
+
+    elif parsed.path.startswith('/api/data/') and len(p) == 4:
+        addr = parseAddress(p[3])
+        reads, writes = database.getDataReferers(addr)
+        return dict(addr=str(addr), name=database.nameForAddress(addr), reads=addressList(reads), writes=addressList(writes))
+
+    elif parsed.path.startswith('/api/bank/') and len(p) == 4:
+        try:
+            bank = int(p[3], 16)
+        except ValueError:
+            raise ApiError(400, 'bad bank: {0}'.format(p[3]))
+        interface = database.getBankInterface(bank)
+        out = dict((key, addressList(addrs)) for key, addrs in interface.items())
+        out['bank'] = bank
+        return out
+
+    elif parsed.path == '/api/names':
+        limit = parseLimit(query)
+        rows = database.getNames(query.get('cursor', [None])[0], limit + 1)
+        page = listing(rows, limit, lambda row: str(row[0]))
+        page['items'] = [dict(addr=str(addr), name=name) for addr, name in page['items']]
+        return page
+
+    raise ApiError(404, 'not found')
@@ -1,4 +1,4 @@
-import json,shutil,os
+import hashlib,json,shutil,os
 class Config:
     def __init__(self, name="awake.json",default=False, rom=False):	
         self.default=default
@@ -13,7 +13,9 @@ class Config:
                 shutil.copy("awake/romdefaults.json",name)
             else:
                 shutil.copy("awake/defaults.json",name)
-        self.config=json.load(open(name))
+        with open(name) as f:
+            self.config=json.load(f)
+        self.cached_version=None
     def get(self,keys):
         tmp=self.config
         try:
@@ -26,5 +28,10 @@ class Config:
             else:
                 tmp=defaultconfig.get(keys)
         return tmp
+    def version(self):
+        if self.cached_version is None:
+            text=json.dumps(self.config,sort_keys=True)
+            self.cached_version=hashlib.sha1(text.encode('utf-8')).hexdigest()
+        return self.cached_version
 defaultconfig=Config("awake/defaults.json",True)
 defaultromconfig=Config("awake/romdefaults",True,True)
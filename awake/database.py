@@ -15,9 +15,11 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import sqlite3
+import threading
+import time
 from contextlib import closing
 from awake import address
-from awake.depend import decodeDependencySet, encodeDependencySet, unknownDependencySet
+from awake.depend import decodeDependencySet, dependencySetVersion, encodeDependencySet, unknownDependencySet
 from awake.operand import ProcAddress
 from awake.textrenderer import HtmlRenderer
 
@@ -36,6 +38,47 @@ def getFirst(x, alt=None):
     else:
         return alt
 
+def bumpVersion(c, name):
+    """Count a change of the named part of the database, within the transaction of cursor c"""
+    c.execute('insert or ignore into versions(name, value) values (?, 0)', (name,))
+    c.execute('update versions set value=value+1 where name=?', (name,))
+
+class QueryStats(object):
+    """Number of queries run and time spent executing them, over all database connections"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.count = 0
+        self.seconds = 0.0
+
+    def add(self, seconds):
+        with self.lock:
+            self.count += 1
+            self.seconds += seconds
+
+QUERY_STATS = QueryStats()
+
+class TimedCursor(sqlite3.Cursor):
+    def execute(self, *args):
+        start = time.perf_counter()
+        try:
+            return super(TimedCursor, self).execute(*args)
+        finally:
+            QUERY_STATS.add(time.perf_counter() - start)
+
+    def executemany(self, *args):
+        start = time.perf_counter()
+        try:
+            return super(TimedCursor, self).executemany(*args)
+        finally:
+            QUERY_STATS.add(time.perf_counter() - start)
+
+class TimedConnection(sqlite3.Connection):
+    """Connection whose cursors count their queries in QUERY_STATS"""
+
+    def cursor(self, factory=TimedCursor):
+        return super(TimedConnection, self).cursor(factory)
+
 class ProcInfo(object):
     def __init__(self, connection, addr, result=None):
 
@@ -45,6 +88,7 @@ class ProcInfo(object):
         result = c.fetchone()
 
         self.addr = addr
+        self.exists = result is not None
         if result:
             self.type = result[0]
             self.depset = decodeDependencySet(result[1])
@@ -108,6 +152,7 @@ class ProcInfo(object):
             c.execute('insert into memref(addr, proc, type) values (?, ?, "read")', (x, self.addr))
         for x in self.memwrites:
             c.execute('insert into memref(addr, proc, type) values (?, ?, "write")', (x, self.addr))
+        bumpVersion(c, 'procs')
         c.close()
         connection.commit()
 
@@ -189,13 +234,22 @@ class Database(object):
         Setup the initial Database for the ROM, creating all the tables if they do not already exist
         :param filename: The filename of the database to write .awakedb
         """
-        self.connection = sqlite3.connect(filename, detect_types=sqlite3.PARSE_DECLTYPES)
+        self.connection = sqlite3.connect(filename, detect_types=sqlite3.PARSE_DECLTYPES, factory=TimedConnection)
 
         c = self.connection.cursor()
         c.execute('create table if not exists procs(addr address, type text, depset text, has_switch integer, suspicious_switch integer, has_suspicious_instr integer, has_nop integer, has_ambig_calls integer, length integer)')
         c.execute('create table if not exists calls(source address, destination address, type text)')
         c.execute('create table if not exists memref(addr address, proc address, type text)')
         c.execute('create table if not exists tags(addr address, name text)')
+        c.execute('create table if not exists flows(addr address, key text, data blob)')
+        c.execute('create table if not exists versions(name text primary key, value integer)')
+        c.execute('create index if not exists procs_addr on procs(addr)')
+        c.execute('create index if not exists calls_source on calls(source)')
+        c.execute('create index if not exists calls_destination on calls(destination)')
+        c.execute('create index if not exists memref_addr on memref(addr)')
+        c.execute('create index if not exists memref_proc on memref(proc)')
+        c.execute('create index if not exists tags_addr on tags(addr)')
+        c.execute('create index if not exists flows_addr on flows(addr)')
         c.close()
         self.connection.commit()
 
@@ -248,12 +302,55 @@ class Database(object):
             c.execute('delete from tags where addr=?', (addr,))
         elif name:
             c.execute('insert into tags (addr, name) values (?, ?)', (addr, name))
+        bumpVersion(c, 'names')
         c.close()
         self.connection.commit()
 
     def procInfo(self, addr):
         return ProcInfo(self.connection, addr)
 
+    def summaryVersion(self, addr):
+        """
+        Version of the proc summary seen by its callers (the depset)
+        :param addr: Address of the proc
+        :return: canonical depset text, changes whenever the stored depset changes
+        """
+        with closing(self.connection.cursor()) as c:
+            c.execute('select depset from procs where addr=?', (addr,))
+            result = c.fetchone()
+        if result:
+            return dependencySetVersion(decodeDependencySet(result[0]))
+        return dependencySetVersion(unknownDependencySet())
+
+    def version(self, name):
+        """
+        Change counter of a part of the database
+        :param name: 'names' for address names, 'procs' for proc summaries and calls
+        """
+        with closing(self.connection.cursor()) as c:
+            c.execute('select value from versions where name=?', (name,))
+            return getFirst(c.fetchone(), 0)
+
+    def getFlowData(self, addr, key):
+        """
+        Stored analysis of the proc at addr
+        :param key: Text identifying the analysis inputs (rom, config, ...)
+        :return: the serialized flow, or None if it was not stored under this key
+        """
+        with closing(self.connection.cursor()) as c:
+            c.execute('select data from flows where addr=? and key=?', (addr, key))
+            return getFirst(c.fetchone())
+
+    def setFlowData(self, addr, key, data):
+        """
+        Store the analysis of the proc at addr, replacing the previous one
+        """
+        c = self.connection.cursor()
+        c.execute('delete from flows where addr=?', (addr,))
+        c.execute('insert into flows(addr, key, data) values (?, ?, ?)', (addr, key, sqlite3.Binary(data)))
+        c.close()
+        self.connection.commit()
+
     def reportProc(self, addr):
         ProcInfo(self.connection, addr).save(self.connection)
 
@@ -281,6 +378,7 @@ class Database(object):
     def setInitial(self, initial):
         c = self.connection.cursor()
         c.executemany('insert into calls(source, destination) values ("FFFF:0000", ?)', ((x,) for x in initial))
+        bumpVersion(c, 'procs')
         c.close()
         self.connection.commit()
 
@@ -289,6 +387,73 @@ class Database(object):
             c.execute('select addr from procs where has_ambig_calls=1')
             return [x[0] for x in c.fetchall()]
 
+    def getProcRows(self, after=None, limit=-1):
+        """
+        Rows of the procs table in address order (addr, type, depset, has_switch, suspicious_switch,
+        has_suspicious_instr, has_nop, has_ambig_calls, length)
+        :param after: Address to start after, None to start from the first proc
+        """
+        with closing(self.connection.cursor()) as c:
+            c.execute('select addr, type, depset, has_switch, suspicious_switch, has_suspicious_instr, has_nop, has_ambig_calls, length from procs where addr>? order by addr limit ?',
+                      (after or '', limit))
+            return c.fetchall()
+
+    def getProcRow(self, addr):
+        """Row of the procs table for addr, as in getProcRows, or None"""
+        with closing(self.connection.cursor()) as c:
+            c.execute('select addr, type, depset, has_switch, suspicious_switch, has_suspicious_instr, has_nop, has_ambig_calls, length from procs where addr=?',
+                      (addr,))
+            return c.fetchone()
+
+    def getCallsInRange(self, first, last):
+        """(source, destination, type) of calls made by procs from first to last, inclusive"""
+        with closing(self.connection.cursor()) as c:
+            c.execute('select source, destination, type from calls where source between ? and ?', (first, last))
+            return c.fetchall()
+
+    def getCallersInRange(self, first, last):
+        """(destination, source) of calls made to addresses from first to last, inclusive"""
+        with closing(self.connection.cursor()) as c:
+            c.execute('select destination, source from calls where destination between ? and ?', (first, last))
+            return c.fetchall()
+
+    def getMemrefsInRange(self, first, last):
+        """(proc, addr, type) of memory references made by procs from first to last, inclusive"""
+        with closing(self.connection.cursor()) as c:
+            c.execute('select proc, addr, type from memref where proc between ? and ?', (first, last))
+            return c.fetchall()
+
+    def getMostCalled(self, limit):
+        """Addresses of the procs with the most callers, most called first"""
+        with closing(self.connection.cursor()) as c:
+            c.execute('select destination from calls group by destination order by count(*) desc, destination limit ?', (limit,))
+            return [x[0] for x in c.fetchall()]
+
+    def getNames(self, after=None, limit=-1):
+        """(addr, name) of named addresses in address order, starting after the given one"""
+        with closing(self.connection.cursor()) as c:
+            c.execute('select addr, name from tags where addr>? order by addr limit ?', (after or '', limit))
+            return c.fetchall()
+
+    def getBankInterface(self, bank):
+        """
+        Cross-bank references of a rom bank
+        :return: dict of address lists: public (called from other banks), dependencies, reads and writes
+        """
+        bank_name = "{:04X}".format(bank)
+        queries = (
+            ('public', 'select destination from calls where substr(source, 0, 5)<>? and substr(destination, 0, 5)=? group by destination order by destination', (bank_name, bank_name)),
+            ('dependencies', 'select destination from calls where substr(source, 0, 5)=? and substr(destination, 0, 5)<>? group by source order by source', (bank_name, bank_name)),
+            ('reads', 'select addr from memref where substr(proc, 0, 5)=? and type=? group by addr order by addr', (bank_name, 'read')),
+            ('writes', 'select addr from memref where substr(proc, 0, 5)=? and type=? group by addr order by addr', (bank_name, 'write')),
+        )
+        out = dict()
+        with closing(self.connection.cursor()) as c:
+            for name, query, params in queries:
+                c.execute(query, params)
+                out[name] = [x[0] for x in c.fetchall()]
+        return out
+
     def getDataReferers(self, data_addr):
         reads = set()
         writes = set()
@@ -14,8 +14,23 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import itertools
+import threading
 from awake.regutil import joinRegisters, splitRegisters, ALL_REGS
 
+# Memoized summaries of flow nodes are tagged with a generation, which moves on whenever an instruction
+# changes its dependencies in place, so the blocks containing it are summarized again. Flow nodes belong
+# to a project copy used by a single thread, so each thread has its own current generation. They are all
+# taken from one counter, so a generation is never reused.
+_generations = itertools.count(1)
+_current = threading.local()
+
+def invalidateDependencies():
+    _current.generation = next(_generations)
+
+def dependencyGeneration():
+    return getattr(_current, 'generation', 0)
+
 def joinDependencies(first, second):
     reads = second.reads - first.writes | first.reads
     writes = first.writes | second.writes
@@ -49,6 +64,10 @@ class DependencySet:
 def encodeDependencySet(depset):
     return ", ".join(str(x) for x in joinRegisters(depset.reads)) + " -> " + ", ".join(str(x) for x in joinRegisters(depset.writes))
 
+def dependencySetVersion(depset):
+    """Canonical text of the depset, equal for equal depsets"""
+    return ", ".join(sorted(str(x) for x in depset.reads)) + " -> " + ", ".join(sorted(str(x) for x in depset.writes))
+
 def decodeDependencySet(text):
     if not text:
         return DependencySet()
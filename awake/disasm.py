@@ -113,16 +113,21 @@ cb_ops = """
 """
 
 class Z80Disasm(object):
-    def __init__(self, proj):
+    def __init__(self, proj, base=None):
         """
         Create the main Z80 Disassembler, Creates two OpcodeDispatchers (main and cb)
         Main are all 1-byte opcodes and cb are the 2 byte opcodes
         Initialises cache and next_addr_cache, although not sure the difference between the 2 caches yet
         :param proj:
+        :param base: Disassembler to share the (read-only) OpcodeDispatchers with
         """
         self.proj = proj
-        self.main = OpcodeDispatcher(main_ops.splitlines())
-        self.cb = OpcodeDispatcher(cb_ops.splitlines())
+        if base:
+            self.main = base.main
+            self.cb = base.cb
+        else:
+            self.main = OpcodeDispatcher(main_ops.splitlines())
+            self.cb = OpcodeDispatcher(cb_ops.splitlines())
         self.cache = dict()
         self.next_addr_cache = dict()
 
@@ -149,3 +154,11 @@ class Z80Disasm(object):
         if addr not in self.cache:
             self.cache[addr], self.next_addr_cache[addr] = self._decode(addr)
         return self.cache[addr], self.next_addr_cache[addr]
+
+    def forget(self, addr):
+        """
+        Drop the cached instruction at addr, so it is decoded again (e.g. to pick up a changed callee depset)
+        :param addr:
+        """
+        self.cache.pop(addr, None)
+        self.next_addr_cache.pop(addr, None)
@@ -14,14 +14,96 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
-import time, re, os, queue
+import time, os, sys, queue
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
 import tkinter as tk
 import tkinter.ttk
 from tkinter.filedialog import asksaveasfilename
 from awake import address, procedure
 from awake.util import AsyncTask, RadioGroup, getTkRoot, BankSelect
-from awake.textrenderer import HtmlRenderer
+from awake.textrenderer import PlainTextRenderer
 from awake.project import Project
+from awake.manifest import ExportManifest, NameRecorder, flowInputs
+from awake.scheduler import AnalysisJob, CancelToken
+
+# procs sent to an export worker process at a time, and chunks in flight per worker
+EXPORT_CHUNK = 16
+EXPORT_WINDOW = 4
+
+# export worker processes run at a lower OS priority than this one
+EXPORT_NICENESS = 10
+
+# the manifest of an export is kept next to it, under this suffix
+MANIFEST_SUFFIX = '.manifest'
+
+def exportProcesses(config):
+    """Worker processes to export with, Export/Processes in the config, 0 for one less than the number of cores"""
+    processes = config.get(['Export', 'Processes'])
+    if not processes:
+        processes = (os.cpu_count() or 1) - 1
+    return max(1, processes)
+
+def renderProc(proj, mode, addr, write):
+    """
+    Render one proc the way export shows it in mode, to write().
+    For flow exports, returns the inputs the text depends on (see ExportManifest), else None.
+    """
+    database = proj.database
+    names = NameRecorder(database)
+    renderer = PlainTextRenderer(names, write)
+    inputs = None
+
+    if mode == 'symbols':
+        if database.hasNameForAddress(addr):
+            renderer.add(str(addr) + ' ' + database.nameForAddress(addr))
+        else:
+            renderer.add(str(addr))
+    elif mode == 'basic':
+        procedure.loadProcedureRange(proj, addr).render(renderer)
+    elif mode == 'flow':
+        proc = proj.flow.uncached(addr)
+        proc.render(renderer)
+        inputs = flowInputs(proj, addr, proc, names.names)
+    else:
+        raise AttributeError
+
+    renderer.finish()
+    return inputs
+
+def exportText(proj, mode, addr):
+    """Export text of a proc, and the inputs it depends on"""
+    out = []
+    inputs = renderProc(proj, mode, addr, out.append)
+    return ''.join(out).encode(), inputs
+
+# project of an export worker process
+worker_proj = None
+
+def initExportWorker(filename, config):
+    global worker_proj
+    sys.stdout = open(os.devnull, 'w')
+    if hasattr(os, 'nice'):
+        os.nice(EXPORT_NICENESS)  # below the server and GUI, whose scheduler the workers bypass
+    worker_proj = Project(filename, config, True)
+
+def exportChunk(mode, addrs):
+    """Export text and inputs of each of the procs, in an export worker process"""
+    return [exportText(worker_proj, mode, addr) for addr in addrs]
+
+def selectProcs(database, scope, bank=None, addr=None):
+    """
+    Known procs in scope: 'all', a single 'bank' or a single 'proc' (addr in conventional form)
+    """
+    if scope == 'all':
+        return sorted(database.getAll())
+    elif scope == 'bank':
+        return sorted(database.getAllInBank(bank))
+    elif scope == 'proc':
+        return [address.fromConventional(addr)]
+    else:
+        raise AttributeError
 
 class ExportTask(AsyncTask):
     scopes = (
@@ -44,6 +126,7 @@ class ExportTask(AsyncTask):
         self.bank = bank
         self.address = address
         self.filename = filename
+        self.current = None
 
     def getDefaultFilename(self):
         a = os.path.dirname(self.base_proj.filename)
@@ -65,51 +148,142 @@ class ExportTask(AsyncTask):
         return x
 
     def work(self):
-        def strip_tags(text):
-            return re.sub(r'<[^><\(\)]*?>', '', text)
+        """
+        Flow exports keep a manifest next to the output. Procs whose inputs did not change since
+        the previous export are copied from it instead of being analyzed and rendered again.
+        """
         proj = self.base_proj.openCopy()
         database = proj.database
 
-        if self.scope == 'all':
-            procs = sorted(database.getAll())
-        elif self.scope == 'bank':
-            procs = sorted(database.getAllInBank(self.bank))
-        elif self.scope == 'proc':
-            procs = [address.fromConventional(self.address)]
-        else:
-            raise AttributeError
-
+        procs = selectProcs(database, self.scope, self.bank, self.address)
         num_procs = len(procs)
-        i = 0
-        with open(self.filename, "wb") as f:
 
-            for addr in procs:
-                if self.requestCancel:
-                    self.report(i, num_procs, "Cancelled")
-                    return
-                self.report(i, num_procs, "Analyzing proc: " + str(addr))
+        manifest_file = self.filename + MANIFEST_SUFFIX
+        previous = ExportManifest.load(manifest_file, self.mode)
+        manifest = ExportManifest(self.mode)
+        old = None
+        if previous.entries and os.path.exists(self.filename):
+            old = open(self.filename, 'rb')
 
-                renderer = HtmlRenderer(database)
+        unchanged = dict()
+        if old and self.mode == 'flow':
+            for addr in procs:
+                if previous.isCurrent(proj, addr):
+                    data = previous.read(old, addr)
+                    if data is not None:
+                        unchanged[addr] = data
+        stale = [addr for addr in procs if addr not in unchanged]
+
+        processes = exportProcesses(proj.config)
+        if self.mode != 'symbols' and processes > 1 and len(stale) > EXPORT_CHUNK:
+            rendered = self.renderParallel(proj.analysisScheduler(), stale, processes)
+        else:
+            rendered = self.renderSerial(proj, stale)
 
-                if self.mode == 'symbols':
-                    if database.hasNameForAddress(addr):
-                        renderer.add(str(addr) + ' ' + database.nameForAddress(addr))
+        # written aside and moved over the old export at the end, it is read from until then
+        temp = self.filename + '.tmp'
+        i = 0
+        offset = 0
+        try:
+            with open(temp, "wb") as f:
+                for addr in procs:
+                    self.current = addr
+                    if addr in unchanged:
+                        self.report(i, num_procs, "Unchanged proc: " + str(addr))
+                        data, inputs = unchanged[addr], previous.entries[str(addr)]['inputs']
                     else:
-                        renderer.add(str(addr))
-                elif self.mode == 'basic':
-                    procedure.loadProcedureRange(proj, addr).render(renderer)
-                elif self.mode == 'flow':
-                    proj.flow.uncached(addr).render(renderer)
-                else:
-                    raise AttributeError
+                        self.report(i, num_procs, "Analyzing proc: " + str(addr))
+                        data, inputs = next(rendered)
+                    if self.requestCancel:
+                        break
+                    f.write(data)
+                    if inputs:
+                        manifest.add(addr, offset, data, inputs)
+                    offset += len(data)
+                    i += 1
+        except StopIteration:
+            pass  # cancelled while rendering
+        except BaseException:
+            if os.path.exists(temp):
+                os.remove(temp)
+            raise
+        finally:
+            rendered.close()
+            if old:
+                old.close()
+            self.current = None
+            proj.close()
+
+        if i < num_procs:
+            os.remove(temp)
+            self.report(i, num_procs, "Cancelled")
+            return
 
-                #print(strip_tags(renderer.getContents()), file=f)
-                f.write(strip_tags(renderer.getContents()).encode())
+        os.replace(temp, self.filename)
+        if self.mode == 'flow':
+            manifest.save(manifest_file)
+        elif os.path.exists(manifest_file):
+            os.remove(manifest_file)
+        self.report(i, num_procs, "Done!")
 
-                i += 1
+    def renderSerial(self, proj, procs):
+        """Export text and inputs of the procs, rendered one by one, stops when cancelled"""
+        job = None
+        if self.mode == 'flow':
+            # analysis runs on the shared scheduler, taking turns with other jobs and yielding to the UI
+            job = proj.analysisScheduler().submit(AnalysisJob(procs, token=CancelToken(self)))
 
-        proj.close()
-        self.report(i, num_procs, "Done!")
+        try:
+            for addr in procs:
+                if job and not proj.analysisScheduler().waitFor(job, addr):
+                    return
+                if self.requestCancel:
+                    return
+                yield exportText(proj, self.mode, addr)
+        finally:
+            if job:
+                job.token.cancel()
+
+    def renderParallel(self, scheduler, procs, processes):
+        """
+        Export text and inputs of the procs, rendered in chunks by worker processes and given back in order
+        as they complete, with a bounded number of chunks in flight. Stops when cancelled.
+
+        The worker processes do not go through the AnalysisScheduler, but keep to its bulk rules as far as
+        they can: they run at a lower OS priority, and like bulk jobs, no new chunk is sent to them while
+        the scheduler serves an interactive request. Chunks already sent still finish.
+        """
+        chunks = [procs[i:i + EXPORT_CHUNK] for i in range(0, len(procs), EXPORT_CHUNK)]
+        # spawned rather than forked, this process runs other threads
+        pool = ProcessPoolExecutor(processes, multiprocessing.get_context('spawn'), initializer=initExportWorker,
+                                   initargs=(self.base_proj.filename, self.base_proj.config))
+        pending = deque()
+        next_chunk = 0
+        try:
+            while pending or next_chunk < len(chunks):
+                while next_chunk < len(chunks) and len(pending) < processes * EXPORT_WINDOW:
+                    if not scheduler.waitQuiet(0.1):
+                        if self.requestCancel:
+                            return
+                        if pending:
+                            break
+                        continue
+                    pending.append(pool.submit(exportChunk, self.mode, chunks[next_chunk]))
+                    next_chunk += 1
+
+                future = pending.popleft()
+                while True:
+                    if self.requestCancel:
+                        return
+                    try:
+                        results = future.result(0.1)
+                        break
+                    except TimeoutError:
+                        pass
+                for result in results:
+                    yield result
+        finally:
+            pool.shutdown(not self.requestCancel, cancel_futures=True)
 
 class ExportDialog(tk.Toplevel):
     def __init__(self, parent=None, proj=None):
@@ -14,120 +14,233 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
-from collections import defaultdict
-from awake import address, flowcontrol, procedure
+import os
+import threading
+from collections import OrderedDict, defaultdict
+from awake import address, flowcontrol, flowcodec, procedure
 from awake.config import Config
 from awake.context import Context
-from awake.depend import DependencySet
+from awake.depend import DependencySet, dependencySetVersion
 from awake.operand import Constant
-from awake.regutil import ALL_REGS
+from awake.passes import PassManager
+
+# rough memory held by an analyzed proc, used to keep ProcedureFlowCache within budget
+FLOW_BASE_BYTES = 4096
+FLOW_INSTRUCTION_BYTES = 2048
 
 def select_any(x):
     return next(iter(x), None)
 
+def reverse_postorder(graph, start=None, visited=None):
+    """List verts reachable from start in reverse postorder. Childs are visited in order, without recursion"""
+    if start is None:
+        start = graph.start()
+    if visited is None:
+        visited = set()
+    visited.add(start)
+    order = []
+    stack = [(start, iter(graph.childs(start)))]
+    while stack:
+        x, childs = stack[-1]
+        for ch in childs:
+            if ch not in visited:
+                visited.add(ch)
+                stack.append((ch, iter(graph.childs(ch))))
+                break
+        else:
+            stack.pop()
+            order.append(x)
+    order.reverse()
+    return order
+
+def _count_bits(x):
+    return bin(x).count('1')
+
 def find_merge_points(graph):
     """Produce a dict of vert->end_points for each fork vert. End points are places, where fork branches merge"""
-    queue = set([graph.start()])
-    visited = set()
-    branches = defaultdict(set)
-
-    def _update(x, parent):
-        updated = False
-        for br in branches[parent]:
-            if br == (x, 0) or br == (x, 1):
-                continue
-            if br not in branches[x]:
-                branches[x].add(br)
-                updated = True
-        return updated
 
-    while queue:
-        x = queue.pop()
-        childs = graph.childs(x)
-
-        visited.add(x)
+    order = [x for x in reverse_postorder(graph) if x is not None]
 
+    # each fork gets a contiguous range of branch tag bits: (vert, i) -> 1 << (offset[vert] + i)
+    offset = dict()
+    owner = []
+    seeds = defaultdict(int)
+    for x in order:
+        childs = graph.childs(x)
         if len(childs) > 1:
-            i = 0
-            for ch in childs:
-                branchtag = (x, i)
-                if branchtag not in branches[ch]:
-                    branches[ch].add(branchtag)
-                    queue.add(ch)
-                i += 1
-
-        for ch in childs:
-            updated = _update(ch, x)
-            if updated or ch not in visited:
-                queue.add(ch)
+            offset[x] = len(owner)
+            for i, ch in enumerate(childs):
+                seeds[ch] |= 1 << (offset[x] + i)
+            owner += [x] * len(childs)
+
+    # a fork does not take back its own two-way branch tags
+    keep = dict((x, ~(3 << offset[x])) for x in offset)
+
+    # propagate tags until fixpoint, sweeping in reverse postorder so forward edges settle in a single pass
+    branches = defaultdict(int)
+    changed = True
+    while changed:
+        changed = False
+        for x in order:
+            incoming = 0
+            for p in graph.parents(x):
+                incoming |= branches[p]
+            if x in keep:
+                incoming &= keep[x]
+            tags = seeds[x] | incoming
+            if tags != branches[x]:
+                branches[x] = tags
+                changed = True
+
+    def _has_join(tags, vert):
+        num_childs = len(graph.childs(vert))
+        count = _count_bits((tags >> offset[vert]) & ((1 << num_childs) - 1))
+        return count == num_childs or count >= 3
 
     merges = defaultdict(set)
 
     for x in graph.vertices():
-        joined = set()
-        for (vert, _) in branches[x]:
-
-            def _has_join(x, vert):
-                #return all(((vert, i) in branches[x]) for i in range(len(graph.childs(vert))))
-                count = 0
-                for i in range(len(graph.childs(vert))):
-                    if (vert, i) in branches[x]:
-                        count += 1
-                return count == len(graph.childs(vert)) or count >= 3
-                """
-                return (vert, 0) in branches[x] and (vert, 1) in branches[x]
-                """
-
-            if not _has_join(x, vert):
+        tags = branches[x]
+        while tags:
+            vert = owner[(tags & -tags).bit_length() - 1]
+            tags &= ~(((1 << len(graph.childs(vert))) - 1) << offset[vert])
+
+            if not _has_join(branches[x], vert):
                 continue
 
             for p in graph.parents(x):
-                if not _has_join(p, vert):
-                    joined.add(vert)
+                if not _has_join(branches[p], vert):
+                    merges[vert].add(x)
                     break
 
-        for y in joined:
-            merges[y].add(x)
-
     return merges
 
-def find_cycles(graph):
-    """Produce a dict of vert -> set of cycles, associating each vertex with cycles it lies on"""
-    visited = set()
-    stack = []
-
-    def _first_dfs(x):
-        visited.add(x)
-        for ch in graph.childs(x):
-            if ch not in visited:
-                _first_dfs(ch)
-        stack.append(x)
-
-    _first_dfs(graph.start())
+class LoopForest(object):
+    """
+    Loop nesting forest of a procedure graph.
 
-    removed = set()
+    A vert heads a loop when it is reached back from a vert later in reverse postorder. The loop contains every
+    vert that reaches the header without passing through verts earlier in reverse postorder. Inner loops are
+    collapsed into their headers (union-find), so the forest is built once in near-linear time, without recursion.
+    """
 
-    def _find_cycle(start):
-        cycle = set()
-        queue = set([start])
-        while queue:
-            x = queue.pop()
-            for p in graph.parents(x):
-                if p not in removed and p not in cycle:
-                    cycle.add(p)
-                    queue.add(p)
-        return cycle
-
-    cycles = defaultdict(set)
+    def __init__(self, graph):
+        self.graph = graph
+        visited = set()
+        order = [x for x in reverse_postorder(graph, graph.start(), visited) if x is not None]
+        self.num_reachable = len(order)
+
+        # verts cut off from the start (left over when a call shrinks the procedure) go last, so they
+        # are never treated as preceding reachable code
+        rest = []
+        for x in graph.vertices():
+            if x not in visited:
+                rest.append(reverse_postorder(graph, x, visited))
+        for tree in reversed(rest):
+            order += [x for x in tree if x is not None]
+
+        self.rpo = dict((x, i) for i, x in enumerate(order))
+        self.headers = set()
+        self.parent = dict()  # vert -> header of the innermost loop it lies in (for headers: the enclosing loop)
+        self.inner = defaultdict(list)  # header -> verts collapsed directly into its loop
+        self.used = set()
+        self.taken = defaultdict(set)
+        self._build(order)
+
+    def _isReachable(self, x):
+        return self.rpo[x] < self.num_reachable
+
+    def _build(self, order):
+        rpo = self.rpo
+        rep = dict((x, x) for x in order)
+
+        def _find(x):
+            root = x
+            while rep[root] != root:
+                root = rep[root]
+            while rep[x] != root:
+                rep[x], x = root, rep[x]
+            return root
+
+        entries = dict()  # representative -> preds of its collapsed region, coming from outside
+
+        for h in reversed(order):
+            # code cut off from the start only leads into reachable loops, it is not collapsed into them
+            preds = [p for p in self.graph.parents(h) if p in rpo and self._isReachable(p) == self._isReachable(h)]
+            back = [p for p in preds if rpo[p] >= rpo[h]]
+            if not back:
+                entries[h] = preds
+                continue
 
-    while stack:
-        x = stack.pop()
-        cycle = _find_cycle(x)
-        for c in cycle:
-            cycles[c].add(tuple(cycle))
-        removed.add(x)
+            self.headers.add(h)
+            body = set()
+            queue = [_find(p) for p in back]
+            while queue:
+                y = queue.pop()
+                if y == h or y in body:
+                    continue
+                body.add(y)
+                for p in entries[y]:
+                    r = _find(p)
+                    if rpo[r] >= rpo[h] and r != h and r not in body:
+                        queue.append(r)
+
+            for y in body:
+                rep[y] = h
+                self.parent[y] = h
+                self.inner[h].append(y)
+                preds += entries.pop(y)
+            entries[h] = [p for p in preds if _find(p) != h]
+
+    def innermost(self, x):
+        """Header of the innermost loop containing x, or None"""
+        if x in self.headers:
+            return x
+        return self.parent.get(x)
+
+    def members(self, header):
+        """All verts of the loop, including nested loops and cut off verts leading into it"""
+        out = set([header])
+        stack = [header]
+        while stack:
+            y = stack.pop()
+            for z in self.inner[y]:
+                out.add(z)
+                stack.append(z)
+
+        if self._isReachable(header) and self.num_reachable < len(self.rpo):
+            stack = list(out)
+            while stack:
+                y = stack.pop()
+                for p in self.graph.parents(y):
+                    if p in self.rpo and not self._isReachable(p) and p not in out:
+                        out.add(p)
+                        stack.append(p)
+        return out
 
-    return cycles
+    def visit(self, x):
+        """Mark loops containing x as used. Enclosing loops of a used loop are used already, so this is amortized O(1)"""
+        h = self.innermost(x)
+        while h is not None and h not in self.used:
+            self.used.add(h)
+            h = self.parent.get(h)
+
+    def take_unused(self, x):
+        """
+        Return members of a loop containing x, that has no visited vert and was not taken at x yet.
+        Usually this is just the loop headed at x. If enclosing loops are still unused too (x entered them from
+        the side), the outermost one is taken first, so loops nest from the outside in.
+        """
+        found = None
+        h = self.innermost(x)
+        while h is not None and h not in self.used:
+            if x not in self.taken[h]:
+                found = h
+            h = self.parent.get(h)
+        if found is None:
+            return None
+        self.taken[found].add(x)
+        return self.members(found)
 
 def find_cycle_exits(graph, cycle):
     """Find verts that are directly accessible from a vert in cycle, but are not in the cycle"""
@@ -144,23 +257,16 @@ class FlowAnalysis(object):
         self.filename=proj.filename
         self.addr = addr
         self.graph = graph
-        self.cycles = find_cycles(self.graph)
+        self.loops = LoopForest(self.graph)
         self.merges = find_merge_points(self.graph)
         self.labels = dict()
         self._visited = set()
 
     def get_unused_cycle(self, x):
-        for cycle in self.cycles[x]:
-            unused = True
-            for y in cycle:
-                if y in self._visited:
-                    unused = False
-                    break
-            if unused:
-                self.cycles[x].remove(cycle)
-                return cycle
+        return self.loops.take_unused(x)
 
     def _process_cascades(self, entry_points, after, break_target, continue_target):
+        """Step processing merge points (or loop exits) one after another. Returns contents and new after"""
         next_after = after
         cascades = list()
         for e in entry_points:
@@ -172,7 +278,7 @@ class FlowAnalysis(object):
             if e in self._visited:
                 continue
 
-            cascades.append(self.process(e, next_after, break_target, continue_target, True))
+            cascades.append((yield self._process(e, next_after, break_target, continue_target, True)))
 
             next_after = e
 
@@ -190,6 +296,10 @@ class FlowAnalysis(object):
         return out, next_after
 
     def process(self, x, after, break_target, continue_target, need_label=False):
+        return flowcontrol.runSteps(self._process(x, after, break_target, continue_target, need_label))
+
+    def _process(self, x, after, break_target, continue_target, need_label=False):
+        """Step structuring the code starting at x. Nested regions are yielded, so they run on an explicit stack"""
         after = self.graph.skipSimpleJumps(after)
         break_target = self.graph.skipSimpleJumps(break_target)
         continue_target = self.graph.skipSimpleJumps(continue_target)
@@ -221,15 +331,16 @@ class FlowAnalysis(object):
                 if exits:
                     exits = set([select_any(exits)])
 
-                cascades, next_after = self._process_cascades(exits, after, break_target, continue_target)
+                cascades, next_after = yield self._process_cascades(exits, after, break_target, continue_target)
 
-                inner = self.process(x, x, next_after, x, True)
+                inner = yield self._process(x, x, next_after, x, True)
                 continue_label = self.labels[x]
 
                 out.append(self.make_while(inner, continue_label))
                 return flowcontrol.Block(out + cascades)
 
             self._visited.add(x)
+            self.loops.visit(x)
             childs = self.graph.childs(x)
 
             if (len(self.graph.parents(x)) > 1 or need_label) and x not in self.labels:
@@ -238,7 +349,7 @@ class FlowAnalysis(object):
                 need_label = False
 
             if len(childs) > 1:
-                cascades, next_after = self._process_cascades(self.merges[x], after, break_target, continue_target)
+                cascades, next_after = yield self._process_cascades(self.merges[x], after, break_target, continue_target)
 
                 prev_contents = self.graph.getContents(x)[:-1]
 
@@ -248,7 +359,7 @@ class FlowAnalysis(object):
                     break_target = next_after
                     branches = []
                     for ch in reversed(childs):
-                        branches.append(self.process(ch, next_after, break_target, continue_target))
+                        branches.append((yield self._process(ch, next_after, break_target, continue_target)))
                         next_after = ch
                     branches.reverse()
                     out += self.make_switch(x, branches)
@@ -256,7 +367,7 @@ class FlowAnalysis(object):
                 else:
                     branches = []
                     for ch in childs:
-                        branches.append(self.process(ch, next_after, break_target, continue_target))
+                        branches.append((yield self._process(ch, next_after, break_target, continue_target)))
                     out += self.make_if(x, branches[0], branches[1])
 
                 return flowcontrol.Block(out + cascades)
@@ -302,7 +413,7 @@ class FlowAnalysis(object):
                 return flowcontrol.DoWhile(inner, postcond, continue_label)
         return flowcontrol.While(inner, continue_label)
 
-    def analyze(self):
+    def initialContext(self):
 
         ctx = Context()
 
@@ -326,19 +437,26 @@ class FlowAnalysis(object):
         if self.addr.inBankedSpace() and not self.addr.isAmbiguous():
             ctx.setValue('ROMBANK', Constant(self.addr.bank()))
 
-        content = self.process(self.graph.start(), None, False, False, True)
-        content = content.optimizedWithContext(ctx)
-        content = content.optimizeDependencies(set(ALL_REGS) - set(['FZ', 'FN', 'FC', 'FH']))
-        return content
+        return ctx
+
+    def analyze(self, passes=None):
+        if passes is None:
+            passes = PassManager()
+        return passes.run(self)
 
 class ProcedureFlow(object):
-    def __init__(self, proj, addr):
+    def __init__(self, proj, addr, passes=None):
         self.addr = addr
 
+        if passes is None:
+            passes = PassManager()
+        self.is_preview = not passes.isComplete()
+
         graph = procedure.loadProcedureGraph(proj, addr)
 
         analysis = FlowAnalysis(proj, addr, graph)
-        self.content = analysis.analyze()
+        self.content = analysis.analyze(passes)
+        self.timings = passes.timings
 
         self.deps = self.content.getDependencySet()
 
@@ -355,32 +473,55 @@ class ProcedureFlow(object):
         self.memreads = set()
         self.memwrites = set()
 
-        for instr in self.getInstructions():
+        # summary versions of the callees, as seen by this analysis
+        self.summary_versions = dict()
 
-            if instr.name == 'CALL':
-                self._calls |= instr.calls()
-            elif instr.name == 'tail-call':
-                self._tail_calls |= instr.calls()
+        self.collectSummary()
 
-            if instr.name in ('CALL', 'tail-call') and not instr.calls():
-                if instr.targetAddr and instr.targetAddr.virtual() == 0xFFC0:
-                    pass
+    def collectSummary(self):
+        """Fill calls, memory references and flags in a single walk over the content"""
+        num_instructions = 0
+
+        for instr in self.content.iterInstructions():
+            num_instructions += 1
+            name = instr.name
+
+            if name in ('CALL', 'tail-call'):
+                calls = instr.calls()
+                if name == 'CALL':
+                    self._calls |= calls
                 else:
-                    self.has_ambig_calls = True
-            if instr.name in ('switch', 'STOP', 'HALT'):
+                    self._tail_calls |= calls
+
+                if not calls:
+                    if instr.targetAddr and instr.targetAddr.virtual() == 0xFFC0:
+                        pass
+                    else:
+                        self.has_ambig_calls = True
+
+                if instr.target_depset_addr != self.addr:  # recursion uses its own last summary
+                    self.summary_versions[instr.target_depset_addr] = dependencySetVersion(instr.target_depset)
+
+            elif name in ('switch', 'STOP', 'HALT'):
                 self.has_suspicious_instr = True
-            if instr.name == 'JP' and not instr.allJumps():
+            elif name == 'JP' and not instr.allJumps():
                 self.has_suspicious_instr = True
-            if instr.name == 'switch-highlevel':
+            elif name == 'switch-highlevel':
                 self.has_switch = True
 
-            self.memreads |= instr.getMemreads()
-            self.memwrites |= instr.getMemwrites()
+            reads = instr.getMemreads()
+            if reads:
+                self.memreads |= reads
+            writes = instr.getMemwrites()
+            if writes:
+                self.memwrites |= writes
 
             #if instr.name == 'switch-highlevel':
             #    if instr.orig.unknownJumpTable():
             #        self._computedJumps = True
 
+        self.size_estimate = FLOW_BASE_BYTES + FLOW_INSTRUCTION_BYTES * num_instructions
+
     def getDependencySet(self):
         return DependencySet(self.deps.reads - set(['FZ', 'FN', 'FC', 'FH']), self.deps.writes)
 
@@ -399,12 +540,47 @@ class ProcedureFlow(object):
         self.content.render(renderer)
 
     def addToIndex(self, index):
-        for x in self.getInstructions():
+        for x in self.content.iterInstructions():
             x.addToIndex(index)
 
+# stored form of analyzed procs, versioned by the layouts of all classes it contains
+FLOW_CODEC = flowcodec.FlowCodec(flowcodec.IR_LAYOUTS + [
+    (ProcedureFlow, ('addr', 'content', 'is_preview', 'timings', 'deps', '_calls', '_tail_calls',
+                     'has_switch', 'suspicious_switch', 'has_suspicious_instr', 'has_nop', 'has_ambig_calls', 'length',
+                     'memreads', 'memwrites', 'summary_versions', 'size_estimate')),
+])
+FLOW_FORMAT = FLOW_CODEC.format
+
+def encodeFlow(proc):
+    """Compact binary form of an analyzed proc"""
+    return FLOW_CODEC.encode(proc)
+
+def decodeFlow(data):
+    """Analyzed proc from encodeFlow output, or None when it was stored in another format or is damaged"""
+    try:
+        proc = FLOW_CODEC.decode(data)
+    except flowcodec.FlowCodecError:
+        return None
+    if not isinstance(proc, ProcedureFlow):
+        return None
+    return proc
+
+def summary_changed(proc, info):
+    """True if the stored proc info differs from what the analysis found"""
+    if dependencySetVersion(info.depset) != dependencySetVersion(proc.getDependencySet()):
+        return True
+    old = (info.has_switch, info.suspicious_switch, info.has_suspicious_instr, info.has_nop, info.has_ambig_calls)
+    new = (proc.has_switch, proc.suspicious_switch, proc.has_suspicious_instr, proc.has_nop, proc.has_ambig_calls)
+    if tuple(map(bool, old)) != tuple(map(bool, new)) or info.length != proc.length:
+        return True
+    return (info.calls != proc.calls() or info.tail_calls != proc.tailCalls()
+            or info.memreads != proc.memreads or info.memwrites != proc.memwrites)
+
 def update_info(proc, database):
-    print('Updating info for', str(proc.addr))
     info = database.procInfo(proc.addr)
+    if info.exists and not summary_changed(proc, info):
+        return
+    print('Updating info for', str(proc.addr))
     info.depset = proc.getDependencySet()
     info.has_switch = proc.has_switch
     info.suspicious_switch = proc.suspicious_switch
@@ -419,21 +595,225 @@ def update_info(proc, database):
     info.memwrites = proc.memwrites
     info.save(database.connection)
 
+class SingleFlight(object):
+    """
+    Lets only one thread at a time run the work for a key. Threads asking for a key that is already
+    in flight wait for it to finish and then look up the result it stored. If there is none, for instance
+    because the work failed, one of them runs the work again while the others keep waiting.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.flights = dict()  # key -> event set when the leading thread is done
+        self.led = 0
+        self.coalesced = 0
+
+    def run(self, key, work, lookup=lambda: None):
+        """
+        Returns the result of work(), or of lookup() after waiting for another thread (None if it found nothing),
+        and whether the call waited for another thread
+        """
+        waited = False
+        while True:
+            with self.lock:
+                done = self.flights.get(key)
+                if done is None:
+                    done = self.flights[key] = threading.Event()
+                    self.led += 1
+                    break
+                self.coalesced += 1
+
+            done.wait()
+            waited = True
+            result = lookup()
+            if result is not None:
+                return result, True
+
+        try:
+            return work(), waited
+        finally:
+            with self.lock:
+                del self.flights[key]
+            done.set()
+
+# in-flight analyses of all projects in this process
+FLIGHTS = SingleFlight()
+
+class FlowBudget(object):
+    """
+    Memory budget shared by the flow caches of a project and all its copies.
+    Each cache drops only its own entries, least recently used first, until the shared total fits.
+    """
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.size = 0
+        self.lock = threading.Lock()
+
+    def add(self, size):
+        """Account for size more bytes (less, if negative). Returns True if the caches are over budget"""
+        with self.lock:
+            self.size += size
+            return self.size > self.limit
+
 class ProcedureFlowCache(object):
-    def __init__(self, proj):
+    """
+    LRU cache of analyzed procs, kept within an estimated memory budget shared with the project copies.
+    An entry is used while the rom, rom config and proc limit match its key, and the summaries of its callees
+    are still the ones it was analyzed with. Limits and summaries only change with the procs table, so once
+    checked, an entry is used without checking again until the procs version of the database moves on.
+    Analyzed procs are also stored in the project database under the same key, so they survive restarts
+    and evictions.
+    A proc is analyzed by one thread at a time. Other project copies asking for it meanwhile wait,
+    and then take the result from the database.
+    """
+
+    def __init__(self, proj, budget=None, flights=FLIGHTS):
         self.proj = proj
-        self.cache = dict()
+        self.flights = flights
+        if budget is None and proj.base is not None:
+            budget = proj.base.flow.budget
+        elif budget is None:
+            budget = FlowBudget(proj.config.get(['Flow-Cache', 'Memory-Budget-MB']) * 1024 * 1024)
+        elif not isinstance(budget, FlowBudget):
+            budget = FlowBudget(budget)
+        self.budget = budget
+        self.cache = OrderedDict()  # addr -> (key, flow, procs version it was last checked at), least recently used first
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.loads = 0
+        self.coalesced = 0
+
+    def cacheKey(self, addr):
+        return (addr, self.proj.rom.digest(), self.proj.romConfig().version(), procedure.getLimit(self.proj, addr))
+
+    def isCurrent(self, flow):
+        database = self.proj.database
+        return all(database.summaryVersion(x) == version for x, version in flow.summary_versions.items())
 
     def uncached(self, addr):
-        return ProcedureFlow(self.proj, addr)
+        key = self.cacheKey(addr)
+        return self._single(key, lambda: self._uncached(addr, key), lambda: self._load(addr, key))
+
+    def _uncached(self, addr, key):
+        proc = self._load(addr, key)
+        if proc is None:
+            proc = ProcedureFlow(self.proj, addr)
+            self._store(addr, key, proc)
+        return proc
 
     def refresh(self, addr):
-        self.cache[addr] = None
-        self.cache[addr] = ProcedureFlow(self.proj, addr)
-        update_info(self.cache[addr], self.proj.database)
+        self._compute(addr, self.cacheKey(addr), False)
 
     def at(self, addr):
+        proc = self._lookup(addr)
+        if proc is not None:
+            return proc
+        self.misses += 1
+        key = self.cacheKey(addr)
+        return self._single(key, lambda: self._compute(addr, key), lambda: self._restore(addr, key))
+
+    def available(self, addr):
+        """Fully analyzed proc if it is cached or stored, None when it would have to be analyzed"""
+        proc = self._lookup(addr)
+        if proc is None:
+            proc = self._restore(addr, self.cacheKey(addr))
+        return proc
+
+    def preview(self, addr):
+        """Fully analyzed proc if it is at hand, otherwise a structure-only analysis, which is not cached"""
+        proc = self.available(addr)
+        if proc is not None:
+            return proc
+        return ProcedureFlow(self.proj, addr, PassManager.preview())
+
+    def _single(self, key, work, lookup):
+        proc, waited = self.flights.run((os.path.abspath(self.proj.filename), key), work, lookup)
+        if waited:
+            self.coalesced += 1
+        return proc
+
+    def _lookup(self, addr):
+        entry = self.cache.get(addr)
+        if entry is None:
+            return None
+        key, proc, checked = entry
+        version = self.proj.database.version('procs')
+        if checked != version or key[2] != self.proj.romConfig().version():
+            if key != self.cacheKey(addr) or not self.isCurrent(proc):
+                return None
+            self.cache[addr] = (key, proc, version)
+        self.hits += 1
+        self.cache.move_to_end(addr)
+        return proc
+
+    def _compute(self, addr, key, use_stored=True):
+        self._drop(addr)
+        proc = None
+        if use_stored:
+            proc = self._load(addr, key)
+        if proc is None:
+            proc = ProcedureFlow(self.proj, addr)
+            if not self.isCurrent(proc):
+                # some instructions were decoded before a callee summary changed
+                self._forgetInstructions(proc)
+                proc = ProcedureFlow(self.proj, addr)
+            update_info(proc, self.proj.database)
+            self._store(addr, key, proc)
+        self._insert(addr, key, proc)
+        return proc
+
+    def _restore(self, addr, key):
+        """Stored proc, put in the cache, or None"""
+        proc = self._load(addr, key)
+        if proc is not None:
+            self._insert(addr, key, proc)
+        return proc
+
+    def _insert(self, addr, key, proc):
+        self._drop(addr)
+        self.cache[addr] = (key, proc, None)
+        self.size += proc.size_estimate
+        over = self.budget.add(proc.size_estimate)
+        while over and len(self.cache) > 1:
+            over = self._drop(next(iter(self.cache)))
+            self.evictions += 1
+        return proc
+
+    def _load(self, addr, key):
+        data = self.proj.database.getFlowData(addr, repr(key))
+        if data is None:
+            return None
+        proc = decodeFlow(data)
+        if proc is None or not self.isCurrent(proc):
+            return None
+        self.loads += 1
+        return proc
+
+    def _store(self, addr, key, proc):
+        self.proj.database.setFlowData(addr, repr(key), encodeFlow(proc))
+
+    def _drop(self, addr):
+        """Returns True if the caches are still over budget"""
         if addr not in self.cache:
-            self.cache[addr] = ProcedureFlow(self.proj, addr)
-            update_info(self.cache[addr], self.proj.database)
-        return self.cache[addr]
+            return self.budget.add(0)
+        key, proc, checked = self.cache.pop(addr)
+        self.size -= proc.size_estimate
+        self._forgetInstructions(proc)
+        return self.budget.add(-proc.size_estimate)
+
+    def clear(self):
+        """Drop all entries, giving their share of the budget back"""
+        while self.cache:
+            self._drop(next(iter(self.cache)))
+
+    def _forgetInstructions(self, proc):
+        # decoded instructions are cached by the disassembler, calls together with the callee depset of that time
+        for instr in proc.content.iterInstructions():
+            self.proj.disasm.forget(instr.addr)
+
+    def stats(self):
+        return dict(hits=self.hits, misses=self.misses, evictions=self.evictions, loads=self.loads,
+                    coalesced=self.coalesced, entries=len(self.cache), size=self.size, budget=self.budget.limit)
@@ -0,0 +1,244 @@
+# This file is part of Awake - GB decompiler.
+# Copyright (C) 2012  Wojciech Marczenko (devdri) <wojtek.marczenko@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import json
+import struct
+import zlib
+from collections import OrderedDict
+from awake import address, depend, flowcontrol, instruction, jumptable, operand, operator
+
+# version of the encoding itself; class layouts are versioned by the fingerprint of IR_LAYOUTS
+CODEC_VERSION = 4
+
+HEADER = struct.Struct('>HI')
+
+INSTRUCTION = ('name', 'addr')
+BASE_OP = INSTRUCTION + ('_operands',)
+FLOW_TERMINATOR = BASE_OP + ('target',)
+JUMP_TARGET = ('cond', 'targetAddr', 'target')
+ADDRESS_CONSTANT = ('value', 'addr')
+BIN_OP = ('left', 'right', 'childs')
+OPERATOR = ('childs',)
+
+# attributes stored for each class of the flow IR
+IR_LAYOUTS = [
+    (address.Address, ('address',)),
+    (depend.DependencySet, ('reads', 'writes')),
+    (jumptable.JumpTable, ('addr', 'targets')),
+
+    (operand.Constant, ('value',)),
+    (operand.ComplexValue, ('hint', 'deps')),
+    (operand.AddressConstant, ADDRESS_CONSTANT),
+    (operand.ProcAddress, ADDRESS_CONSTANT),
+    (operand.LabelAddress, ADDRESS_CONSTANT),
+    (operand.DataAddress, ADDRESS_CONSTANT),
+    (operand.JumpTableAddress, ADDRESS_CONSTANT),
+    (operand.Register, ('name',)),
+    (operand.Condition, ('name',)),
+    (operand.Dereference, ('target', 'addr', 'childs')),
+    (operand.ComputedProcAddress, ('bank', 'addr', 'childs')),
+] + [(cls, BIN_OP) for cls in (
+    operator.Add, operator.Sub, operator.And, operator.Or, operator.Xor, operator.Equals, operator.NotEquals,
+    operator.Less, operator.GreaterEqual, operator.Shl, operator.Shr,
+    operator.Add16, operator.Sub16, operator.Shl16, operator.Shr16,
+)] + [(cls, OPERATOR) for cls in (
+    operator.LogicalNot, operator.PopValue, operator.PopStack, operator.Push,
+    operator.CarryOfAdd, operator.LowByte, operator.HighByte, operator.Word,
+)] + [
+    (instruction.Instruction, INSTRUCTION),
+    (instruction.BaseOp, BASE_OP),
+    (instruction.ExpressionOp, BASE_OP + ('_reads', '_writes', '_values', '_loads', '_memory_refs')),
+    (instruction.LoadInstruction, BASE_OP + ('_reads', '_writes', '_values', '_loads', '_memory_refs', 'target', 'source')),
+    (instruction.BadOpcode, INSTRUCTION),
+    (instruction.JumpInstruction, INSTRUCTION + ('_reads', '_writes') + JUMP_TARGET),
+    (instruction.CallInstruction, INSTRUCTION + JUMP_TARGET + ('target_depset', 'target_depset_addr', 'returns_used', 'constant_params')),
+    (instruction.TailCall, INSTRUCTION + JUMP_TARGET + ('target_depset', 'target_depset_addr', 'returns_used', 'constant_params')),
+    (instruction.SwitchInstruction, BASE_OP + ('jt',)),
+    (instruction.RetInstruction, INSTRUCTION + ('cond',)),
+
+    (flowcontrol.Label, BASE_OP + ('gotos', 'breaks', 'continues', 'needed', 'depset')),
+    (flowcontrol.Goto, FLOW_TERMINATOR + ('target_label',)),
+    (flowcontrol.Break, FLOW_TERMINATOR + ('target_label',)),
+    (flowcontrol.Continue, FLOW_TERMINATOR + ('target_label',)),
+    (flowcontrol.Return, FLOW_TERMINATOR),
+    (flowcontrol.Block, ('contents',)),
+    (flowcontrol.Switch, ('name', 'arg', 'addr', 'branches', 'jtAddr', 'base_value')),
+    (flowcontrol.If, ('name', 'split', 'addr', 'cond', 'option_a', 'option_b')),
+    (flowcontrol.DoWhile, ('name', 'addr', 'inner', 'postcond', 'continue_label')),
+    (flowcontrol.While, ('name', 'inner', 'addr', 'continue_label')),
+]
+
+SCALARS = (type(None), bool, int, float, str)
+
+CONTAINERS = {list: 'l', tuple: 't', set: 's', frozenset: 'f', dict: 'd', OrderedDict: 'o'}
+
+# classes without their own __getstate__ are stored with their whole __dict__
+DEFAULT_GETSTATE = getattr(object, '__getstate__', None)
+
+class FlowCodecError(Exception):
+    pass
+
+class FlowCodec(object):
+    """
+    Versioned binary form of analyzed procs.
+
+    The object graph is flattened into a table of records in postorder, so nothing recurses however deep
+    the flow is, and shared or cyclic references (labels and their gotos) are kept. An object record is
+    its class number followed by the attributes listed in its layout, other values are plain JSON with
+    references to earlier records. Decoding only instantiates the listed classes, without calling them.
+    Stored data carries the codec version and a fingerprint of all layouts, so data written by another
+    version is refused. An object with an attribute missing from its layout cannot be encoded at all.
+    """
+
+    def __init__(self, layouts):
+        self.classes = [cls for cls, fields in layouts]
+        self.fields = [tuple(fields) for cls, fields in layouts]
+        self.numbers = dict((cls, i) for i, cls in enumerate(self.classes))
+        schema = repr([(cls.__module__ + '.' + cls.__qualname__, fields) for cls, fields in zip(self.classes, self.fields)])
+        self.fingerprint = zlib.crc32(schema.encode('utf-8')) & 0xFFFFFFFF
+        self.format = '{0}.{1:08x}'.format(CODEC_VERSION, self.fingerprint)
+
+    def _items(self, x):
+        """Values held by x, in the order they are stored"""
+        t = type(x)
+        if t in (dict, OrderedDict):
+            out = []
+            for k, v in x.items():
+                out += [k, v]
+            return out
+        if t in CONTAINERS:
+            return list(x)
+        number = self.numbers.get(t)
+        if number is None:
+            raise FlowCodecError('no layout for {0}'.format(t.__qualname__))
+        state = x.__getstate__() if getattr(t, '__getstate__', None) not in (None, DEFAULT_GETSTATE) else x.__dict__
+        fields = self.fields[number]
+        extra = set(state) - set(fields)
+        if extra:
+            raise FlowCodecError('layout of {0} lacks {1}'.format(t.__qualname__, ', '.join(sorted(extra))))
+        return [state.get(name, MISSING) for name in fields]
+
+    def encode(self, root):
+        # every object reachable from root, children first
+        items = dict()  # id -> values held
+        order = []
+        items[id(root)] = self._items(root)
+        stack = [(root, iter(items[id(root)]))]
+        while stack:
+            x, it = stack[-1]
+            for y in it:
+                if type(y) in SCALARS or y is MISSING or id(y) in items:
+                    continue
+                items[id(y)] = self._items(y)
+                stack.append((y, iter(items[id(y)])))
+                break
+            else:
+                stack.pop()
+                order.append(x)
+
+        index = dict((id(x), i) for i, x in enumerate(order))
+
+        def value(y):
+            if type(y) in SCALARS:
+                return y
+            if y is MISSING:
+                return []
+            return [index[id(y)]]
+
+        records = []
+        for x in order:
+            t = type(x)
+            kind = CONTAINERS.get(t)
+            if kind is None:
+                kind = self.numbers[t]
+            records.append([kind] + [value(y) for y in items[id(x)]])
+
+        data = json.dumps(records, separators=(',', ':'), allow_nan=False).encode('utf-8')
+        return HEADER.pack(CODEC_VERSION, self.fingerprint) + zlib.compress(data)
+
+    def decode(self, data):
+        """Object graph from encode output. Raises FlowCodecError if it was written by another version or is damaged"""
+        data = bytes(data)
+        if len(data) < HEADER.size or HEADER.unpack(data[:HEADER.size]) != (CODEC_VERSION, self.fingerprint):
+            raise FlowCodecError('stored in another format')
+        try:
+            records = json.loads(zlib.decompress(data[HEADER.size:]).decode('utf-8'))
+            return self._build(records)
+        except (ValueError, TypeError, IndexError, KeyError, AttributeError, RecursionError, zlib.error) as e:
+            raise FlowCodecError('damaged data: {0}'.format(e))
+
+    def _build(self, records):
+        if not records:
+            raise FlowCodecError('no records')
+
+        # empty shells first, so records can refer to each other in any direction
+        objs = []
+        for rec in records:
+            kind = rec[0]
+            if type(kind) is int:
+                if kind < 0:
+                    raise FlowCodecError('unknown class')
+                cls = self.classes[kind]
+                objs.append(cls.__new__(cls))
+            elif kind in ('l', 's', 'd', 'o'):
+                objs.append({'l': list, 's': set, 'd': dict, 'o': OrderedDict}[kind]())
+            elif kind in ('t', 'f'):
+                objs.append(MISSING)  # immutable, built when filled
+            else:
+                raise FlowCodecError('unknown record kind')
+
+        def value(v):
+            if type(v) in SCALARS:
+                return v
+            if type(v) is not list or len(v) != 1 or type(v[0]) is not int or v[0] < 0:
+                raise FlowCodecError('bad value')
+            y = objs[v[0]]
+            if y is MISSING:
+                raise FlowCodecError('reference to an unfinished record')
+            return y
+
+        # children come before their parents, so set members are complete when they are hashed
+        for i, rec in enumerate(records):
+            kind = rec[0]
+            if type(kind) is int:
+                fields = self.fields[kind]
+                if len(rec) != len(fields) + 1:
+                    raise FlowCodecError('bad record for {0}'.format(self.classes[kind].__qualname__))
+                state = objs[i].__dict__
+                for name, v in zip(fields, rec[1:]):
+                    if v == []:
+                        continue
+                    state[name] = value(v)
+            elif kind == 'l':
+                objs[i].extend(value(v) for v in rec[1:])
+            elif kind == 's':
+                objs[i].update(value(v) for v in rec[1:])
+            elif kind in ('d', 'o'):
+                values = [value(v) for v in rec[1:]]
+                if len(values) % 2:
+                    raise FlowCodecError('bad mapping')
+                objs[i].update(zip(values[::2], values[1::2]))
+            elif kind == 't':
+                objs[i] = tuple(value(v) for v in rec[1:])
+            else:
+                objs[i] = frozenset(value(v) for v in rec[1:])
+
+        return objs[-1]
+
+class _Missing(object):
+    """Marks a layout attribute that the object does not have"""
+
+MISSING = _Missing()
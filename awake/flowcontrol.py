@@ -16,7 +16,7 @@
 
 from awake import address, placeholders
 from awake.context import Context
-from awake.depend import DependencySet, dependParallel, joinDependencies, unknownDependencySet
+from awake.depend import DependencySet, dependencyGeneration, dependParallel, invalidateDependencies, joinDependencies, unknownDependencySet
 from awake.instruction import BaseOp, Instruction
 from awake.operand import AddressConstant, Constant, JumpTableAddress, LabelAddress
 from awake.regutil import ALL_REGS, joinRegisters
@@ -57,6 +57,8 @@ class Label(BaseOp):
 
     def optimizeDependencies(self, needed):
         if self.gotos or self.breaks or self.continues:
+            if self.needed != needed or self.depset.reads != needed:
+                invalidateDependencies()
             self.needed = set(needed)
             self.depset.reads = needed
             return self
@@ -147,76 +149,193 @@ class Return(FlowTerminator):
     def getDependencies(self, needed):
         return needed
 
-class Block(Instruction):
-    def __init__(self, contents):
+def runSteps(steps):
+    """
+    Run a generator based pass without recursion. A step yields the generator of a nested step and gets its
+    return value back; pending steps are kept on an explicit stack, so deep nesting does not grow the call stack.
+    """
+    stack = [steps]
+    value = None
+    while stack:
+        try:
+            nested = stack[-1].send(value)
+        except StopIteration as e:
+            stack.pop()
+            value = e.value
+        else:
+            stack.append(nested)
+            value = None
+    return value
+
+class ControlStructure(Instruction):
+    """
+    Instruction containing nested blocks. Tree passes are implemented as steps (see runSteps).
+    Dependency summaries and complexity are memoized per node; dependency memos are dropped whenever
+    an instruction changes its dependencies in place (see depend.invalidateDependencies).
+    """
+
+    _depset_memo = None
+    _needed_memo = None
+    _complexity_memo = None
+
+    def __getstate__(self):
+        # memos are tied to the generation counter of this process
+        state = dict(self.__dict__)
+        for name in ('_depset_memo', '_needed_memo', '_complexity_memo'):
+            state.pop(name, None)
+        return state
+
+    def _getDependencySet(self):
+        generation = dependencyGeneration()
+        if self._depset_memo is None or self._depset_memo[0] != generation:
+            depset = yield self._collectDependencySet()
+            self._depset_memo = (generation, depset)
+        return self._depset_memo[1]
+
+    def _getDependencies(self, needed):
+        generation = dependencyGeneration()
+        if self._needed_memo is None or self._needed_memo[0] != generation:
+            self._needed_memo = (generation, dict())
+        memo = self._needed_memo[1]
+        key = frozenset(needed)
+        if key not in memo:
+            memo[key] = yield self._collectDependencies(needed)
+        return memo[key]
+
+    def _complexity(self):
+        if self._complexity_memo is None:
+            self._complexity_memo = yield self._collectComplexity()
+        return self._complexity_memo
+
+    def optimizedWithContext(self, ctx):
+        return runSteps(self._optimizedWithContext(ctx))
+
+    def getDependencies(self, needed):
+        return runSteps(self._getDependencies(needed))
+
+    def getDependencySet(self):
+        return runSteps(self._getDependencySet())
+
+    def optimizeDependencies(self, needed):
+        return runSteps(self._optimizeDependencies(needed))
+
+    def getInstructions(self, out):
+        out.update(self.iterInstructions())
+
+    def iterInstructions(self):
+        """Every instruction of the tree, including control structures but not blocks, in a single walk"""
+        stack = [self]
+        while stack:
+            x = stack.pop()
+            if isinstance(x, ControlStructure):
+                stack += x.nested()
+                if not isinstance(x, Block):
+                    yield x
+            else:
+                yield x
+
+    def nested(self):
+        """Directly nested blocks (or instructions, for a block)"""
+        return []
+
+    def render(self, renderer):
+        runSteps(self._render(renderer))
+
+class Block(ControlStructure):
+    def __init__(self, contents, split=True):
+        if not split:
+            self.contents = contents
+            return
         self.contents = []
         for x in contents:
             self.contents += x.splitToSimple()
-        #self.contents = contents
 
-    def __bool__(self):
-        return bool(self.contents)
-        
     def __bool__(self):
         return bool(self.contents)
 
     """Heuristic code complexity inside block"""
     def complexity(self):
+        return runSteps(self._complexity())
+
+    def _collectComplexity(self):
         out = 0
         for x in self.contents:
-            if hasattr(x, 'complexity'):
+            if isinstance(x, (Block, LoopWhile)):
+                out += yield x._complexity()
+            elif hasattr(x, 'complexity'):
                 out += x.complexity()
             out += 1
         return out
 
     def hasContinue(self):
+        return runSteps(self._hasContinue())
+
+    def _hasContinue(self):
         if not self.contents:
             return True
-        return self.contents[-1].hasContinue()
+        last = self.contents[-1]
+        if isinstance(last, (Block, If)):
+            return (yield last._hasContinue())
+        return last.hasContinue()
 
-    def render(self, renderer):
+    def _render(self, renderer):
         for el in self.contents:
-            el.render(renderer)
+            if isinstance(el, ControlStructure):
+                yield el._render(renderer)
+            else:
+                el.render(renderer)
 
     def __str__(self):
         return 'block'+str(len(self.contents))+':'+str(bool(self))+'(' + ','.join(sorted(str(el) for el in self.contents)) + ')'
 
-    def optimizedWithContext(self, context):
+    def _optimizedWithContext(self, context):
         contents = []
         for instr in self.contents:
-            instr = instr.optimizedWithContext(context)
+            if isinstance(instr, ControlStructure):
+                instr = yield instr._optimizedWithContext(context)
+            else:
+                instr = instr.optimizedWithContext(context)
             contents.append(instr)
-        return Block(contents)
+        return Block(contents, False)
 
-    def getDependencies(self, needed):
+    def _collectDependencies(self, needed):
         for instr in reversed(self.contents):
-            needed = instr.getDependencies(needed)
+            if isinstance(instr, ControlStructure):
+                needed = yield instr._getDependencies(needed)
+            else:
+                needed = instr.getDependencies(needed)
         return needed
 
-    def getDependencySet(self):
+    def _collectDependencySet(self):
         cur = DependencySet()
         for instr in reversed(self.contents):
-            cur = joinDependencies(instr.getDependencySet(), cur)
+            if isinstance(instr, ControlStructure):
+                deps = yield instr._getDependencySet()
+            else:
+                deps = instr.getDependencySet()
+            cur = joinDependencies(deps, cur)
         return cur
 
-    def optimizeDependencies(self, needed):
+    def _optimizeDependencies(self, needed):
         contents = []
         for instr in reversed(self.contents):
-            instr = instr.optimizeDependencies(needed)
+            if isinstance(instr, ControlStructure):
+                instr = yield instr._optimizeDependencies(needed)
+            else:
+                instr = instr.optimizeDependencies(needed)
             if instr:
-                needed = instr.getDependencies(needed)
+                if isinstance(instr, ControlStructure):
+                    needed = yield instr._getDependencies(needed)
+                else:
+                    needed = instr.getDependencies(needed)
                 contents.append(instr)
         contents.reverse()
-        return Block(contents)
+        return Block(contents, False)
 
-    def getInstructions(self, out):
-        for x in self.contents:
-            if hasattr(x, 'getInstructions'):
-                x.getInstructions(out)
-            else:
-                out.add(x)
+    def nested(self):
+        return self.contents
 
-class Switch(Instruction):
+class Switch(ControlStructure):
     def __init__(self, addr, branches, arg=None, base_value=0):
         self.name = 'switch-highlevel'
         if not arg:
@@ -231,7 +350,7 @@ class Switch(Instruction):
     def valueForBranch(self, i):
         return Constant(self.base_value + i)
 
-    def render(self, renderer):
+    def _render(self, renderer):
         renderer.newInstruction(self.addr)
         renderer.instructionName('switch')
         renderer.add(' (')
@@ -247,17 +366,15 @@ class Switch(Instruction):
             self.valueForBranch(i).render(renderer)
             renderer.add(':')
             with renderer.indent():
-                b.render(renderer)
+                yield b._render(renderer)
 
         renderer.newInstruction(self.addr)
         renderer.add('}')
 
-    def getInstructions(self, out):
-        for b in self.branches:
-            b.getInstructions(out)
-        out.add(self)
+    def nested(self):
+        return self.branches
 
-    def optimizedWithContext(self, ctx):
+    def _optimizedWithContext(self, ctx):
         arg = self.arg.optimizedWithContext(ctx)
 
         base_value = self.base_value
@@ -267,30 +384,34 @@ class Switch(Instruction):
             base_value += arg.right.value
             arg = arg.left
 
-        branches = [b.optimizedWithContext(ctx.clone()) for b in self.branches]
+        branches = []
         for b in self.branches:
-            for w in b.getDependencySet().writes:
+            branches.append((yield b._optimizedWithContext(ctx.clone())))
+        for b in self.branches:
+            for w in (yield b._getDependencySet()).writes:
                 ctx.setValueComplex(w)
         return Switch(self.addr, branches, arg, base_value)
 
-    def getDependencies(self, needed):
+    def _collectDependencies(self, needed):
         deps = self.arg.getDependencies()
         for b in self.branches:
-            deps |= b.getDependencies(needed)
+            deps |= yield b._getDependencies(needed)
         return deps
 
-    def getDependencySet(self):
+    def _collectDependencySet(self):
         deps = DependencySet()
         for b in self.branches:
-            deps = dependParallel(b.getDependencySet(), deps)
+            deps = dependParallel((yield b._getDependencySet()), deps)
         return DependencySet(deps.reads | self.arg.getDependencies(), deps.writes)
 
-    def optimizeDependencies(self, needed):
-        branches = [b.optimizeDependencies(needed) for b in self.branches]
+    def _optimizeDependencies(self, needed):
+        branches = []
+        for b in self.branches:
+            branches.append((yield b._optimizeDependencies(needed)))
         return Switch(self.addr, branches, self.arg, self.base_value)
 
 
-class If(Instruction):
+class If(ControlStructure):
     def __init__(self, split, cond, option_a, option_b):
         self.name = 'if'
         self.split = split
@@ -308,11 +429,14 @@ class If(Instruction):
         return instr.name == 'break'
 
     def hasContinue(self):
+        return runSteps(self._hasContinue())
+
+    def _hasContinue(self):
         if not self.option_a or not self.option_b:
             return True
-        return self.option_a.hasContinue() or self.option_b.hasContinue()
+        return (yield self.option_a._hasContinue()) or (yield self.option_b._hasContinue())
 
-    def render(self, renderer):
+    def _render(self, renderer):
         addr = self.addr
         renderer.newInstruction(addr)
         renderer.instructionName('if')
@@ -326,21 +450,21 @@ class If(Instruction):
 
         elif not self.option_a:
             with renderer.indent():
-                self.option_b.render(renderer)
+                yield self.option_b._render(renderer)
         else:
             with renderer.indent():
-                self.option_a.render(renderer)
+                yield self.option_a._render(renderer)
 
         if self.option_b and self.option_a:
             renderer.newInstruction(addr)
             renderer.instructionName('} else {')
             with renderer.indent():
-                self.option_b.render(renderer)
+                yield self.option_b._render(renderer)
 
         renderer.newInstruction(addr)
         renderer.add('}')
 
-    def optimizedWithContext(self, ctx):
+    def _optimizedWithContext(self, ctx):
 
         cond = self.cond.optimizedWithContext(ctx)
 
@@ -348,69 +472,67 @@ class If(Instruction):
 
         option_a = None
         if self.option_a:
-            option_a = self.option_a.optimizedWithContext(ctx.clone())
+            option_a = yield self.option_a._optimizedWithContext(ctx.clone())
         option_b = None
         if self.option_b:
-            option_b = self.option_b.optimizedWithContext(ctx.clone())
+            option_b = yield self.option_b._optimizedWithContext(ctx.clone())
 
         if self.option_a:
-            for w in self.option_a.getDependencySet().writes:
+            for w in (yield self.option_a._getDependencySet()).writes:
                 ctx.setValueComplex(w)
         if self.option_b:
-            for w in self.option_b.getDependencySet().writes:
+            for w in (yield self.option_b._getDependencySet()).writes:
                 ctx.setValueComplex(w)
 
         return If(self.split, cond, option_a, option_b)
 
-    def getDependencies(self, needed):
+    def _collectDependencies(self, needed):
         deps = set()
         if self.option_a:
-            deps |= self.option_a.getDependencies(needed)
+            deps |= yield self.option_a._getDependencies(needed)
         else:
             deps |= needed
         if self.option_b:
-            deps |= self.option_b.getDependencies(needed)
+            deps |= yield self.option_b._getDependencies(needed)
         else:
             deps |= needed
         deps |= self.cond.getDependencies()
         return deps
 
-    def getDependencySet(self):
+    def _collectDependencySet(self):
         deps = DependencySet()
         if self.option_a:
-            deps = dependParallel(self.option_a.getDependencySet(), deps)
+            deps = dependParallel((yield self.option_a._getDependencySet()), deps)
         if self.option_b:
-            deps = dependParallel(self.option_b.getDependencySet(), deps)
+            deps = dependParallel((yield self.option_b._getDependencySet()), deps)
         cond_deps = DependencySet(self.cond.getDependencies())
         return joinDependencies(cond_deps, deps)
 
-    def optimizeDependencies(self, needed):
+    def _optimizeDependencies(self, needed):
         option_a = None
         if self.option_a:
-            option_a = self.option_a.optimizeDependencies(needed)
+            option_a = yield self.option_a._optimizeDependencies(needed)
         option_b = None
         if self.option_b:
-            option_b = self.option_b.optimizeDependencies(needed)
+            option_b = yield self.option_b._optimizeDependencies(needed)
         return If(self.split, self.cond, option_a, option_b)
 
-    def getInstructions(self, out):
-        if self.option_a:
-            self.option_a.getInstructions(out)
-        if self.option_b:
-            self.option_b.getInstructions(out)
-        out.add(self)
+    def nested(self):
+        return [b for b in (self.option_a, self.option_b) if b]
 
     def getMemreads(self):
         return self.cond.getMemreads()
 
-class LoopWhile(Instruction):
+class LoopWhile(ControlStructure):
 
     def complexity(self):
-        return 4 + self.inner.complexity()
+        return runSteps(self._complexity())
 
-    def getInstructions(self, out):
-        self.inner.getInstructions(out)
-        out.add(self)
+    def _collectComplexity(self):
+        return 4 + (yield self.inner._complexity())
+
+    def nested(self):
+        return [self.inner]
 
 class DoWhile(LoopWhile):
     def __init__(self, inner, postcond, continue_label):
@@ -421,53 +543,56 @@ class DoWhile(LoopWhile):
         self.continue_label = continue_label
         continue_label.addContinue(self)
 
-    def render(self, renderer):
+    def _render(self, renderer):
         addr = "0000:0000"  # TODO: inner first addr
 
         renderer.newInstruction(addr)
         renderer.instructionName('do {')
-        renderer.instructionSignature(self.signature())
+        renderer.instructionSignature((yield self._signature()))
         with renderer.indent():
-            self.inner.render(renderer)
+            yield self.inner._render(renderer)
         renderer.newInstruction(addr)
         renderer.instructionName('} while (')
         self.postcond.render(renderer)
         renderer.add(')')
 
-    def optimizedWithContext(self, ctx):
+    def _optimizedWithContext(self, ctx):
 
-        self.continue_label.setContextWrites(self.getDependencySet().writes)
+        self.continue_label.setContextWrites((yield self._getDependencySet()).writes)
 
         #ctx.invalidateAll()
         #ctx2 = context.Context()
         ctx2 = ctx
 
-        inner = self.inner.optimizedWithContext(ctx2)
+        inner = yield self.inner._optimizedWithContext(ctx2)
         postcond = self.postcond.optimizedWithContext(ctx2)
         return DoWhile(inner, postcond, self.continue_label)
 
-    def getDependencies(self, needed):
-        pass1 = self.inner.getDependencies(needed | self.postcond.getDependencies())
-        pass2 = self.inner.getDependencies(pass1)
+    def _collectDependencies(self, needed):
+        pass1 = yield self.inner._getDependencies(needed | self.postcond.getDependencies())
+        pass2 = yield self.inner._getDependencies(pass1)
 
-        pass3 = self.inner.getDependencies(pass2)
+        pass3 = yield self.inner._getDependencies(pass2)
         assert pass2 == pass3
 
         return pass2
 
-    def getDependencySet(self):
-        x = self.inner.getDependencySet()
+    def _collectDependencySet(self):
+        x = yield self.inner._getDependencySet()
         postcond_deps = DependencySet(self.postcond.getDependencies())
         return joinDependencies(x, postcond_deps)
 
-    def optimizeDependencies(self, needed):
+    def _optimizeDependencies(self, needed):
         if self.continue_label:
-            self.continue_label.optimizeDependencies(self.getDependencies(needed))
-        inner = self.inner.optimizeDependencies(needed | self.postcond.getDependencies() | self.getDependencies(needed))
+            self.continue_label.optimizeDependencies((yield self._getDependencies(needed)))
+        inner = yield self.inner._optimizeDependencies(needed | self.postcond.getDependencies() | (yield self._getDependencies(needed)))
         return DoWhile(inner, self.postcond, self.continue_label)
 
     def signature(self):
-        deps = self.inner.getDependencySet()
+        return runSteps(self._signature())
+
+    def _signature(self):
+        deps = yield self.inner._getDependencySet()
         loopvars = deps.writes & (deps.reads | self.postcond.getDependencies())
         loopvars -= set(['mem'])
         loopvars = joinRegisters(loopvars)
@@ -484,47 +609,49 @@ class While(LoopWhile):
         self.continue_label = continue_label
         continue_label.addContinue(self)
 
-    def render(self, renderer):
+    def _render(self, renderer):
         addr = "0000:0000"  # TODO: inner first addr
 
         renderer.newInstruction(addr)
         renderer.instructionName('while (1) {')
-        renderer.instructionSignature(self.signature())
+        renderer.instructionSignature((yield self._signature()))
         with renderer.indent():
-            self.inner.render(renderer)
+            yield self.inner._render(renderer)
         renderer.newInstruction(addr)
         renderer.instructionName('}')
 
     def hasContinue(self):
         return False
 
-    def optimizedWithContext(self, ctx):
+    def _optimizedWithContext(self, ctx):
         ctx.invalidateAll()
-        inner = self.inner.optimizedWithContext(Context())
+        inner = yield self.inner._optimizedWithContext(Context())
         return While(inner, self.continue_label)
 
-    def getDependencies(self, needed):
-        pass1 = self.inner.getDependencies(needed)
-        pass2 = self.inner.getDependencies(pass1)
+    def _collectDependencies(self, needed):
+        pass1 = yield self.inner._getDependencies(needed)
+        pass2 = yield self.inner._getDependencies(pass1)
 
-        pass3 = self.inner.getDependencies(pass2)
+        pass3 = yield self.inner._getDependencies(pass2)
         assert pass2 == pass3
 
         return pass2
 
-    def getDependencySet(self):
-        return self.inner.getDependencySet()
+    def _collectDependencySet(self):
+        return (yield self.inner._getDependencySet())
 
-    def optimizeDependencies(self, needed):
+    def _optimizeDependencies(self, needed):
         if self.continue_label:
-            self.continue_label.optimizeDependencies(self.getDependencies(needed))
-        inner = self.inner.optimizeDependencies(needed | self.getDependencies(needed))
+            self.continue_label.optimizeDependencies((yield self._getDependencies(needed)))
+        inner = yield self.inner._optimizeDependencies(needed | (yield self._getDependencies(needed)))
         return While(inner, self.continue_label)
 
     def signature(self):
-        deps = self.inner.getDependencySet()
+        return runSteps(self._signature())
+
+    def _signature(self):
+        deps = yield self.inner._getDependencySet()
         loopvars = deps.writes & deps.reads
         loopvars -= set(['mem'])
         loopvars = joinRegisters(loopvars)
         return " @ loopvars: " + ", ".join(sorted(str(x) for x in loopvars if not isinstance(x, address.Address)))
-
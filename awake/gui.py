@@ -21,7 +21,7 @@ from tkinter.filedialog import askopenfilename
 from awake.config import Config
 from awake.export import ExportDialog
 from awake.project import Project
-from awake.pages import dispatchUrl
+from awake.pages import dispatchUrl, ProcedureFlowPage
 from awake.server import ServerDialog
 from awake.textrenderer import TkRenderer
 from awake.util import getTkRoot
@@ -82,6 +82,8 @@ class MainWindow(tk.Toplevel):
         self.server_button.pack(side='right')
         self.export_button = tkinter.ttk.Button(toolbar, text="Export...", width=10, command=self.showExport)
         self.export_button.pack(side='right')
+        self.refresh_button = tkinter.ttk.Button(toolbar, text="Reanalyze", width=10, command=self.refreshPage)
+        self.refresh_button.pack(side='right')
 
         self.main = MainFrame(self.main_pane, self.proj)
         self.main.pack(side='top', fill='both', expand=True)
@@ -117,6 +119,7 @@ class MainWindow(tk.Toplevel):
         if not self.proj:
             self.debug_symbols_button.configure(state='disabled')
             self.export_button.configure(state='disabled')
+            self.refresh_button.configure(state='disabled')
             self.server_button.configure(state='disabled')
             self.history.disable()
 
@@ -135,6 +138,7 @@ class MainWindow(tk.Toplevel):
 
         fresh = MainWindow(getTkRoot(), filename)
         fresh.geometry(self.geometry())
+        self.main.close()
         self.destroy()
 
     def importDebugSymbols(self):
@@ -148,10 +152,14 @@ class MainWindow(tk.Toplevel):
         self.proj.importDebugSymbols(filename)
         self.main.reloadPage()
 
+    def refreshPage(self):
+        self.main.refreshPage()
+
     def wait(self):
         self.wait_window(self)
 
     def quit(self, *args):
+        self.main.close()
         self.destroy()
         self.parent.destroy()
 
@@ -173,12 +181,17 @@ class MainFrame(tkinter.ttk.Frame):
             self.text.tag_config(key, foreground=value)
 
         self.url = None
+        self.page = None
+        self.scheduler = None
+        if self.proj:
+            self.scheduler = self.proj.analysisScheduler()
+            self.scheduler.warmUp()
         self.openSplashPage()
 
     def setLinkCallback(self, cb):
         self.text.linkCallback = cb
 
-    def openPage(self, url):
+    def openPage(self, url, progressive=True):
         self.text.delete(1.0, 'end')
 
         if not self.proj:
@@ -186,16 +199,37 @@ class MainFrame(tkinter.ttk.Frame):
             return
 
         self.url = url
-        page = dispatchUrl(self.proj, url)
-        if not page:
-            self.text.insert('end', '404 Not found')
-        else:
+        with self.scheduler.interactive():
+            page = dispatchUrl(self.proj, url, progressive)
+            self.page = page
+            if not page:
+                self.text.insert('end', '404 Not found')
+                return
+
             renderer = TkRenderer(self.proj.database, self.text)
             if page.has_name_form:
                 self.address_name.setAddress(page.addr)
-            page.load()
+            if isinstance(page, ProcedureFlowPage):
+                self.scheduler.prefetch(page.info.calls | page.info.tail_calls | page.info.callers)
+            if getattr(page, 'pending', False) and self.scheduler.isReady(page.addr):
+                # analyzed in background, but the result did not make it to the store
+                self.openPage(url, False)
+                return
+            if getattr(page, 'pending', False):
+                # analyzed in background while the preview is rendered
+                self.scheduler.request(page.addr)
+                self.after(100, self.waitForFlow, url, page.addr)
             page.render(renderer)
 
+    def waitForFlow(self, url, addr):
+        """Swap in the flow view once the background analysis is done"""
+        if self.url != url:
+            return
+        if self.scheduler.isReady(addr):
+            self.openPage(url)
+        else:
+            self.after(100, self.waitForFlow, url, addr)
+
     def openSplashPage(self):
         self.text.delete(1.0, 'end')
         self.text.insert('end', 'Awake\n\n')
@@ -204,6 +238,18 @@ class MainFrame(tkinter.ttk.Frame):
     def reloadPage(self):
         self.openPage(self.url)
 
+    def close(self):
+        if self.scheduler:
+            self.scheduler.stop()
+
+    def refreshPage(self):
+        """Reanalyze what the current page shows"""
+        if not self.page:
+            return
+        self.page.refresh()
+        self.text.delete(1.0, 'end')
+        self.page.render(TkRenderer(self.proj.database, self.text))
+
 class History(tkinter.ttk.Frame):
     def __init__(self, parent):
         tkinter.ttk.Frame.__init__(self, parent)
@@ -15,7 +15,7 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 from awake import address, placeholders
-from awake.depend import DependencySet, unknownDependencySet
+from awake.depend import DependencySet, invalidateDependencies, unknownDependencySet
 from awake.expression import parse
 from awake.jumptable import JumpTable
 from awake.operand import ComplexValue, ComputedProcAddress, JumpTableAddress, ProcAddress
@@ -99,6 +99,7 @@ class ExpressionOp(BaseOp):
         self._writes = writes
         self._values = values
         self._loads = loads
+        self._memory_refs = None
 
     def optimizedWithContext(self, ctx):
         for w in self._writes:
@@ -146,19 +147,23 @@ class ExpressionOp(BaseOp):
             return None
         return self
 
+    def _memoryRefs(self):
+        # splitting allocates and parses new instructions, so it is done once for both reads and writes
+        if self._memory_refs is None:
+            reads = set()
+            writes = set()
+            for instr in self.splitToSimple():
+                if instr != self:
+                    reads |= instr.getMemreads()
+                    writes |= instr.getMemwrites()
+            self._memory_refs = (reads, writes)
+        return self._memory_refs
+
     def getMemreads(self):
-        out = set()
-        for instr in self.splitToSimple():
-            if instr != self:
-                out |= instr.getMemreads()
-        return out
+        return set(self._memoryRefs()[0])
 
     def getMemwrites(self):
-        out = set()
-        for instr in self.splitToSimple():
-            if instr != self:
-                out |= instr.getMemwrites()
-        return out
+        return set(self._memoryRefs()[1])
 
 class BadOpcode(Instruction):
     def __init__(self, opcodes, addr):
@@ -248,6 +253,7 @@ class CallInstruction(Instruction):
             self.target = target
 
         self.target_depset = proj.database.procInfo(self.targetAddr).depset
+        self.target_depset_addr = self.targetAddr
 
         self.returns_used = ALL_REGS
         self.constant_params = dict()
@@ -285,6 +291,8 @@ class CallInstruction(Instruction):
 
         for param in ins:
             if ctx.hasConstantValue(param):
+                if param not in self.constant_params:
+                    invalidateDependencies()  # known params are no longer read
                 self.constant_params[param] = ctx.getValue(param)
 
         for w in deps.writes:
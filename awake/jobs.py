@@ -0,0 +1,253 @@
+# This file is part of Awake - GB decompiler.
+# Copyright (C) 2014  Wojciech Marczenko (devdri) <wojtek.marczenko@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import threading
+import time
+import traceback
+from collections import OrderedDict
+from awake import address
+from awake.api import ApiError
+from awake.export import ExportTask, selectProcs
+from awake.scheduler import AnalysisError, AnalysisJob, CancelToken
+from awake.util import AsyncTask
+
+# finished jobs kept for listing, oldest dropped first
+JOB_HISTORY = 50
+
+class AnalysisTask(AsyncTask):
+    """
+    Analyze the procs in scope on the analysis scheduler and save their summaries to the database.
+    With discover, the procs they call are analyzed too, until no new ones turn up.
+    Procs whose analysis fails are skipped, and the task fails at the end, naming them.
+    """
+
+    def __init__(self, proj, scope='all', bank=None, address=None, discover=False):
+        super(AnalysisTask, self).__init__()
+        self.base_proj = proj
+        self.scope = scope
+        self.bank = bank
+        self.address = address
+        self.discover = discover
+        self.current = None
+
+    def work(self):
+        proj = self.base_proj.openCopy()
+        token = CancelToken(self)
+        try:
+            scheduler = proj.analysisScheduler()
+            todo = selectProcs(proj.database, self.scope, self.bank, self.address)
+            seen = set(todo)
+            done = 0
+            failed = []
+            while todo:
+                job = scheduler.submit(AnalysisJob(todo, token=token, update=True))
+                found = []
+                for addr in todo:
+                    self.current = addr
+                    self.report(done, len(seen), "Analyzing proc: " + str(addr))
+                    try:
+                        if not scheduler.waitFor(job, addr):
+                            self.report(done, len(seen), "Cancelled")
+                            return
+                    except AnalysisError as e:
+                        failed.append(str(e))
+                        done += 1
+                        continue
+                    done += 1
+                    if self.discover:
+                        info = proj.database.procInfo(addr)
+                        for callee in sorted(info.calls | info.tail_calls):
+                            if callee not in seen and callee.inPhysicalMem() and not callee.isAmbiguous():
+                                seen.add(callee)
+                                found.append(callee)
+                todo = found
+        finally:
+            token.cancel()  # stops what is left of the job if analysis failed
+            self.current = None
+            proj.close()
+
+        if failed:
+            self.report(done, done, "Analysis of {0} procs failed".format(len(failed)))
+            raise AnalysisError('analysis of {0} procs failed: {1}'.format(len(failed), '; '.join(failed)))
+        self.report(done, done, "Done!")
+
+def makeTask(proj, kind, params):
+    """
+    Task for a job submitted with request parameters (lists of strings, as from parse_qs).
+    Raises ApiError for bad parameters.
+    """
+    def param(name, default=None):
+        return params.get(name, [default])[0]
+
+    scope = param('scope', 'all')
+    bank = None
+    addr = param('addr')
+    if scope == 'bank':
+        try:
+            bank = int(param('bank', ''), 16)
+        except ValueError:
+            raise ApiError(400, 'bank expected')
+    elif scope == 'proc':
+        try:
+            address.fromConventional(addr or '')
+        except ValueError:
+            raise ApiError(400, 'addr expected')
+    elif scope != 'all':
+        raise ApiError(400, 'unknown scope: {0}'.format(scope))
+
+    if kind in ('analyze', 'discover'):
+        return AnalysisTask(proj, scope, bank, addr, kind == 'discover')
+    elif kind == 'export':
+        mode = param('mode', 'flow')
+        if mode not in [value for _, value in ExportTask.modes]:
+            raise ApiError(400, 'unknown mode: {0}'.format(mode))
+        task = ExportTask(proj, scope, mode, bank, addr)
+        # written next to the rom, clients do not get to pick paths on the server
+        task.filename = task.getDefaultFilename()
+        return task
+    else:
+        raise ApiError(400, 'unknown job kind: {0}'.format(kind))
+
+class Job(object):
+    """
+    An AsyncTask running on its own thread, with its progress reports kept for clients to poll or wait on.
+    """
+
+    def __init__(self, job_id, kind, task):
+        self.id = job_id
+        self.kind = kind
+        self.task = task
+        self.condition = threading.Condition()
+        self.version = 0  # bumped on every change
+        self.state = 'running'
+        self.cancelled = False
+        self.error = None
+        self.done = 0
+        self.total = 0
+        self.message = ''
+        self.started = time.monotonic()
+        self.finished = None
+        task.report = self.report
+
+    def start(self):
+        thread = threading.Thread(target=self.work)
+        thread.daemon = True
+        thread.start()
+
+    def work(self):
+        # what executeSynchronous does, but keeping a cancel that came in before the thread got here
+        with self.condition:
+            self.task.error = None
+            self.task.requestCancel = self.cancelled
+        try:
+            if not self.cancelled:
+                self.task.work()
+            state = 'cancelled' if self.cancelled else 'finished'
+        except Exception as e:
+            traceback.print_exc()
+            self.error = str(e)
+            state = 'failed'
+        with self.condition:
+            self.state = state
+            self.finished = time.monotonic()
+            self.version += 1
+            self.condition.notify_all()
+
+    def report(self, done, total, message):
+        with self.condition:
+            self.done = done
+            self.total = total
+            self.message = message
+            self.version += 1
+            self.condition.notify_all()
+
+    def cancel(self):
+        with self.condition:
+            self.cancelled = True
+            self.task.requestCancel = True
+
+    def isRunning(self):
+        return self.state == 'running'
+
+    def snapshot(self):
+        """Progress as a JSON-friendly dict: procs per second over the whole run, ETA in seconds"""
+        with self.condition:
+            elapsed = (self.finished or time.monotonic()) - self.started
+            rate = self.done / elapsed if elapsed > 0 else 0.0
+            eta = None
+            if self.isRunning() and rate > 0:
+                eta = round((self.total - self.done) / rate, 1)
+            current = getattr(self.task, 'current', None)
+            return OrderedDict([
+                ('id', self.id),
+                ('kind', self.kind),
+                ('state', self.state),
+                ('done', self.done),
+                ('total', self.total),
+                ('current', str(current) if current is not None and self.isRunning() else None),
+                ('message', self.message),
+                ('elapsed', round(elapsed, 2)),
+                ('rate', round(rate, 2)),
+                ('eta', eta),
+                ('error', self.error),
+                ('filename', getattr(self.task, 'filename', None)),
+            ])
+
+    def waitChange(self, version, timeout):
+        """
+        Wait until the job changes from version, returns the current version,
+        which is the same one if nothing changed within timeout seconds
+        """
+        with self.condition:
+            if self.version == version:
+                self.condition.wait(timeout)
+            return self.version
+
+class JobList(object):
+    """Background jobs submitted to the server"""
+
+    def __init__(self, proj):
+        self.proj = proj
+        self.lock = threading.Lock()
+        self.jobs = OrderedDict()
+        self.next_id = 1
+
+    def submit(self, kind, params):
+        task = makeTask(self.proj, kind, params)
+        with self.lock:
+            job = Job(str(self.next_id), kind, task)
+            self.next_id += 1
+            self.jobs[job.id] = job
+            finished = [x for x in self.jobs.values() if not x.isRunning()]
+            for old in finished[:max(0, len(finished) - JOB_HISTORY)]:
+                del self.jobs[old.id]
+        job.start()
+        return job
+
+    def get(self, job_id):
+        with self.lock:
+            job = self.jobs.get(job_id)
+        if job is None:
+            raise ApiError(404, 'no job {0}'.format(job_id))
+        return job
+
+    def all(self):
+        with self.lock:
+            return list(self.jobs.values())
+
+    def cancelAll(self):
+        for job in self.all():
+            job.cancel()
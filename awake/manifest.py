@@ -0,0 +1,107 @@
+# This file is part of Awake - GB decompiler.
+# Copyright (C) 2014  Wojciech Marczenko (devdri) <wojtek.marczenko@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import hashlib
+import json
+import os
+from awake import address
+from awake.flow import FLOW_FORMAT
+
+MANIFEST_FORMAT = 1
+
+class NameRecorder(object):
+    """Database stand-in for a renderer, noting the names it looks up"""
+
+    def __init__(self, database):
+        self.database = database
+        self.names = dict()
+
+    def nameForAddress(self, addr):
+        name = self.database.nameForAddress(addr)
+        self.names[str(addr)] = name
+        return name
+
+    def __getattr__(self, name):
+        return getattr(self.database, name)
+
+def flowInputs(proj, addr, proc, names):
+    """What the flow export of a proc depends on: the flow cache key, the callee summaries its analysis used, and the names shown"""
+    return dict(
+        key=repr(proj.flow.cacheKey(addr)),
+        summaries=dict((str(x), version) for x, version in proc.summary_versions.items()),
+        names=names,
+    )
+
+class ExportManifest(object):
+    """
+    Where each proc is in an exported file, with a hash of its text and the inputs it was rendered from,
+    kept next to the file so a later export can copy the procs whose inputs did not change.
+    """
+
+    def __init__(self, mode):
+        self.mode = mode
+        self.entries = dict()  # addr -> dict(offset, length, sha1, inputs)
+
+    def header(self):
+        return dict(format=MANIFEST_FORMAT, flow_format=FLOW_FORMAT, mode=self.mode)
+
+    @classmethod
+    def load(cls, filename, mode):
+        """Manifest of the previous export to filename, an empty one if there is none or it does not apply"""
+        manifest = cls(mode)
+        try:
+            with open(filename) as f:
+                data = json.load(f)
+        except (IOError, ValueError):
+            return manifest
+        if data.get('header') == manifest.header():
+            manifest.entries = data.get('entries', dict())
+        return manifest
+
+    def save(self, filename):
+        temp = filename + '.tmp'
+        with open(temp, 'w') as f:
+            json.dump(dict(header=self.header(), entries=self.entries), f, sort_keys=True)
+        os.replace(temp, filename)
+
+    def add(self, addr, offset, data, inputs):
+        self.entries[str(addr)] = dict(offset=offset, length=len(data), sha1=hashlib.sha1(data).hexdigest(), inputs=inputs)
+
+    def isCurrent(self, proj, addr):
+        """True if the proc would be rendered from the same inputs as last time"""
+        entry = self.entries.get(str(addr))
+        if not entry or not entry.get('inputs'):
+            return False
+        inputs = entry['inputs']
+        database = proj.database
+        if inputs['key'] != repr(proj.flow.cacheKey(addr)):
+            return False
+        for x, version in inputs['summaries'].items():
+            if database.summaryVersion(address.fromConventional(x)) != version:
+                return False
+        for x, name in inputs['names'].items():
+            if database.nameForAddress(address.fromConventional(x)) != name:
+                return False
+        return True
+
+    def read(self, f, addr):
+        """Text of the proc in the previous export f, None if it was changed since"""
+        entry = self.entries[str(addr)]
+        f.seek(entry['offset'])
+        data = f.read(entry['length'])
+        if len(data) != entry['length'] or hashlib.sha1(data).hexdigest() != entry['sha1']:
+            return None
+        return data
@@ -0,0 +1,180 @@
+# This file is part of Awake - GB decompiler.
+# Copyright (C) 2014  Wojciech Marczenko (devdri) <wojtek.marczenko@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import bisect
+import os
+import threading
+from collections import OrderedDict
+from awake.database import QUERY_STATS
+from awake.flow import FLIGHTS
+from awake.passes import PASS_STATS
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# upper bounds of the request latency buckets, in seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+def routeOf(path):
+    """Route label for a request path, pages by kind with the address left out"""
+    path = path.split('?')[0]
+    if path.startswith('/proc/'):
+        if path.endswith('/basic'):
+            return '/proc/basic'
+        if path.endswith('/flow'):
+            return '/proc/flow'
+        return '/proc'
+    for prefix in ('/jump', '/data', '/bank', '/home', '/api', '/jobs', '/refresh', '/set-name', '/metrics'):
+        if path == prefix or path.startswith(prefix + '/') or path.startswith(prefix + '?'):
+            return prefix
+    return 'other'
+
+class Histogram(object):
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # the last one is +Inf
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+class RequestMetrics(object):
+    """Request counts and latency histograms per route, shared by the server threads"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counts = OrderedDict()  # (route, status) -> requests
+        self.latency = OrderedDict()  # route -> Histogram
+
+    def observe(self, route, status, seconds):
+        with self.lock:
+            key = (route, status)
+            self.counts[key] = self.counts.get(key, 0) + 1
+            if route not in self.latency:
+                self.latency[route] = Histogram()
+            self.latency[route].observe(seconds)
+
+def processMemory():
+    """Resident set size of this process in bytes, None if unknown"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (IOError, OSError, ValueError, AttributeError):
+        pass
+    if resource:
+        # peak rather than current, in kilobytes on Linux and bytes on macOS
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    return None
+
+def formatValue(value):
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
+
+class MetricsText(object):
+    """Builds a page in the Prometheus text exposition format"""
+
+    def __init__(self):
+        self.lines = []
+
+    def metric(self, name, kind, doc, samples):
+        """:param samples: (labels dict, value) pairs"""
+        self.lines.append('# HELP {0} {1}'.format(name, doc))
+        self.lines.append('# TYPE {0} {1}'.format(name, kind))
+        for labels, value in samples:
+            self.sample(name, labels, value)
+
+    def sample(self, name, labels, value):
+        if labels:
+            text = ','.join('{0}="{1}"'.format(k, v) for k, v in labels.items())
+            name = '{0}{{{1}}}'.format(name, text)
+        self.lines.append('{0} {1}'.format(name, formatValue(value)))
+
+    def text(self):
+        return '\n'.join(self.lines) + '\n'
+
+def renderMetrics(server):
+    """
+    Metrics of a ThreadPoolHTTPServer. Cache figures are summed over the project copies
+    of the server threads and of the analysis workers.
+    """
+    out = MetricsText()
+    requests = server.metrics
+
+    with requests.lock:
+        counts = list(requests.counts.items())
+        latency = [(route, list(h.counts), h.count, h.sum) for route, h in requests.latency.items()]
+
+    out.metric('awake_http_requests_total', 'counter', 'HTTP requests served, by route and status.',
+               [(OrderedDict([('route', route), ('status', status)]), n) for (route, status), n in counts])
+
+    out.metric('awake_http_request_duration_seconds', 'histogram', 'Time to serve HTTP requests, by route.', [])
+    name = 'awake_http_request_duration_seconds'
+    for route, buckets, count, total in latency:
+        cumulative = 0
+        for bound, n in zip(LATENCY_BUCKETS + ('+Inf',), buckets):
+            cumulative += n
+            out.sample(name + '_bucket', OrderedDict([('route', route), ('le', bound)]), cumulative)
+        out.sample(name + '_sum', dict(route=route), total)
+        out.sample(name + '_count', dict(route=route), count)
+
+    scheduler = server.scheduler
+    projects = list(server.projects) + list(scheduler.projects)
+    stats = [proj.flow.stats() for proj in projects]
+
+    def total(key):
+        return sum(x[key] for x in stats)
+
+    out.metric('awake_flow_cache_hits_total', 'counter', 'Flow cache lookups answered from memory.', [({}, total('hits'))])
+    out.metric('awake_flow_cache_misses_total', 'counter', 'Flow cache lookups that had to load or analyze the proc.', [({}, total('misses'))])
+    out.metric('awake_flow_cache_evictions_total', 'counter', 'Procs dropped from the flow cache to stay within budget.', [({}, total('evictions'))])
+    out.metric('awake_flow_store_loads_total', 'counter', 'Analyzed procs loaded from the database.', [({}, total('loads'))])
+    out.metric('awake_flow_cache_entries', 'gauge', 'Procs in the flow caches.', [({}, total('entries'))])
+    out.metric('awake_flow_cache_bytes', 'gauge', 'Estimated size of the flow caches.', [({}, total('size'))])
+    out.metric('awake_decode_cache_entries', 'gauge', 'Decoded instructions kept by the disassemblers.',
+               [({}, sum(len(proj.disasm.cache) for proj in projects))])
+
+    passes = PASS_STATS.snapshot()
+    out.metric('awake_flow_pass_runs_total', 'counter', 'Analysis passes run, by pass.',
+               [({'pass': name}, runs) for name, runs, seconds in passes])
+    out.metric('awake_flow_pass_seconds_total', 'counter', 'Time spent in analysis passes, by pass.',
+               [({'pass': name}, seconds) for name, runs, seconds in passes])
+
+    out.metric('awake_db_queries_total', 'counter', 'Database queries run.', [({}, QUERY_STATS.count)])
+    out.metric('awake_db_query_seconds_total', 'counter', 'Time spent executing database queries.', [({}, QUERY_STATS.seconds)])
+
+    with scheduler.condition:
+        queued = OrderedDict([
+            ('interactive', len(scheduler.requests)),
+            ('prefetch', len(scheduler.prefetch_queue)),
+            ('bulk', sum(len(job.todo) for job in scheduler.jobs)),
+        ])
+        active = scheduler.active
+    out.metric('awake_analyses_in_flight', 'gauge', 'Procs being analyzed or loaded, by any thread.', [({}, len(FLIGHTS.flights))])
+    out.metric('awake_scheduler_active', 'gauge', 'Procs being analyzed by the scheduler workers.', [({}, active)])
+    out.metric('awake_scheduler_queued', 'gauge', 'Procs waiting for the scheduler, by priority.',
+               [(dict(priority=priority), n) for priority, n in queued.items()])
+
+    memory = processMemory()
+    if memory is not None:
+        out.metric('awake_process_resident_memory_bytes', 'gauge', 'Resident memory of the process.', [({}, memory)])
+
+    return out.text()
@@ -24,28 +24,58 @@ class Page(object):
     This is a page which contains text and links (think of it like a webpage)
     """
     has_name_form = False
+    has_refresh = False
 
     def __init__(self, proj, url):
         self.proj = proj
         self.url = url
         self.load()
 
+    def refresh(self):
+        """Recompute what the page shows instead of using stored results, then load it again"""
+        self.load()
+
 class ProcedureFlowPage(Page):
+    """
+    Structured view of a proc. A progressive page does not wait for the analysis: until it is
+    available the page is pending and shows a structure-only preview instead.
+    """
     has_name_form = True
+    has_refresh = True
+
+    def __init__(self, proj, url, progressive=False):
+        self.progressive = progressive
+        super(ProcedureFlowPage, self).__init__(proj, url)
 
     def load(self):
         p = self.url.split('/')
         self.addr = address.fromConventional(p[2])
         self.info = self.proj.database.procInfo(self.addr)
-        self.proj.flow.refresh(self.addr)
+        if self.progressive:
+            self.proc = self.proj.flow.available(self.addr)
+            self.pending = self.proc is None
+            return
+        self.pending = False
         self.proc = self.proj.flow.at(self.addr)
 
+    def refresh(self):
+        self.proj.flow.refresh(self.addr)
+        self.progressive = False
+        self.load()
+
     def render(self, r):
         """
         Writes the procedure info, name, the callers, callees etc
         :param r:
         """
+        proc = self.proc
+        if self.pending:
+            proc = self.proj.flow.preview(self.addr)
+
         with r.lineAddress(self.addr), r.comment():
+            if proc.is_preview:
+                r.write("Flow analysis in progress, showing structure only")
+                r.startNewLine()
             r.write("Menu: /home | /data | /jump | /proc | /bank")
             r.hline()
 
@@ -59,12 +89,16 @@ class ProcedureFlowPage(Page):
 
             r.startNewLine()
             r.write("  This procedure calls: ")
-            r.writeList(ProcAddress(x) for x in sorted(self.proc.calls()))
+            r.writeList(ProcAddress(x) for x in sorted(proc.calls()))
+
+            r.startNewLine()
+            r.write("  Analysis passes: ")
+            r.write(', '.join('{0} {1:.1f} ms'.format(name, seconds * 1000) for name, seconds in proc.timings.items()))
 
             r.hline()
 
         with r.indent():
-            self.proc.render(r)
+            proc.render(r)
 
 class ProcedureDisasmPage(Page):
     has_name_form = True
@@ -172,49 +206,24 @@ class BankSummaryPage(Page):
         self.bank = int(p[2], 16)
         
     def render(self, renderer):
-        bank_name = "{:04X}".format(self.bank)
-
-        c = self.proj.database.connection.cursor()
-
-        renderer.startNewLine()
-        renderer.add('public interface:')
-        c.execute('select destination from calls where substr(source, 0, 5)<>? and substr(destination, 0, 5)=? group by destination order by destination', (bank_name, bank_name))
-        with renderer.indent():
-            for addr, in c.fetchall():
-                renderer.startNewLine()
-                ProcAddress(addr).render(renderer)
-
-        renderer.startNewLine()
-        renderer.add('dependencies:')
-        c.execute('select destination from calls where substr(source, 0, 5)=? and substr(destination, 0, 5)<>? group by source order by source', (bank_name, bank_name))
-        with renderer.indent():
-            for addr, in c.fetchall():
-                renderer.startNewLine()
-                ProcAddress(addr).render(renderer)
-
-        renderer.startNewLine()
-        renderer.add('reads:')
-        c.execute('select addr from memref where substr(proc, 0, 5)=? and type=? group by addr order by addr', (bank_name, 'read'))
-        with renderer.indent():
-            for addr, in c.fetchall():
-                renderer.startNewLine()
-                DataAddress(addr).render(renderer)
-
-        renderer.startNewLine()
-        renderer.add('writes:')
-        c.execute('select addr from memref where substr(proc, 0, 5)=? and type=? group by addr order by addr', (bank_name, 'write'))
-        with renderer.indent():
-            for addr, in c.fetchall():
-                renderer.startNewLine()
-                DataAddress(addr).render(renderer)
-
-        c.close()
-
-def dispatchUrl(proj, url):
+        interface = self.proj.database.getBankInterface(self.bank)
+
+        for title, key, klass in (('public interface:', 'public', ProcAddress),
+                                  ('dependencies:', 'dependencies', ProcAddress),
+                                  ('reads:', 'reads', DataAddress),
+                                  ('writes:', 'writes', DataAddress)):
+            renderer.startNewLine()
+            renderer.add(title)
+            with renderer.indent():
+                for addr in interface[key]:
+                    renderer.startNewLine()
+                    klass(addr).render(renderer)
+
+def dispatchUrl(proj, url, progressive=False):
     if url.startswith('/proc/'):
         if url.endswith('/basic'):
             return ProcedureDisasmPage(proj, url)
-        return ProcedureFlowPage(proj, url)
+        return ProcedureFlowPage(proj, url, progressive)
     elif url.startswith('/jump/'):
         return JumptablePage(proj, url)
     elif url.startswith('/data/'):
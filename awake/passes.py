@@ -0,0 +1,122 @@
+# This file is part of Awake - GB decompiler.
+# Copyright (C) 2012  Wojciech Marczenko (devdri) <wojtek.marczenko@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import threading
+import time
+from collections import OrderedDict
+from awake.regutil import ALL_REGS
+
+class FlowPass(object):
+    """
+    A step of the proc analysis pipeline. Passes declare the properties of the content they need (requires)
+    and the ones they establish (provides), so a pipeline can be checked before it runs.
+    """
+    name = None
+    requires = ()
+    provides = ()
+    expensive = False
+
+    def run(self, analysis, content):
+        raise NotImplementedError
+
+class StructurePass(FlowPass):
+    """Turn the proc graph into nested blocks, ifs, loops and switches"""
+    name = 'structure'
+    provides = ('structured',)
+
+    def run(self, analysis, content):
+        return analysis.process(analysis.graph.start(), None, False, False, True)
+
+class ContextPass(FlowPass):
+    """Propagate known values (constants, rom bank) forward through the code"""
+    name = 'context'
+    requires = ('structured',)
+    provides = ('values',)
+    expensive = True
+
+    def run(self, analysis, content):
+        return content.optimizedWithContext(analysis.initialContext())
+
+class DependencyPass(FlowPass):
+    """Remove writes that are never read, and compute what each label and loop needs"""
+    name = 'dependencies'
+    requires = ('structured',)
+    provides = ('liveness',)
+    expensive = True
+
+    def run(self, analysis, content):
+        return content.optimizeDependencies(set(ALL_REGS) - set(['FZ', 'FN', 'FC', 'FH']))
+
+class PassStats(object):
+    """Runs of each pass and time spent in them, over all analyses in this process"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.runs = OrderedDict()
+        self.seconds = OrderedDict()
+
+    def add(self, name, seconds):
+        with self.lock:
+            self.runs[name] = self.runs.get(name, 0) + 1
+            self.seconds[name] = self.seconds.get(name, 0.0) + seconds
+
+    def snapshot(self):
+        """List of (pass name, runs, seconds)"""
+        with self.lock:
+            return [(name, self.runs[name], self.seconds[name]) for name in self.runs]
+
+PASS_STATS = PassStats()
+
+# registered passes, by name
+PASSES = OrderedDict((p.name, p) for p in (StructurePass, ContextPass, DependencyPass))
+
+DEFAULT_PIPELINE = ('structure', 'context', 'dependencies')
+
+class PassManager(object):
+    """
+    Runs a pipeline of registered passes and records how long each one took.
+    :param names: Pass names, in order of execution
+    """
+
+    def __init__(self, names=DEFAULT_PIPELINE):
+        self.passes = [PASSES[name]() for name in names]
+        self.timings = OrderedDict()
+
+        available = set()
+        for p in self.passes:
+            missing = set(p.requires) - available
+            if missing:
+                raise ValueError('pass {0} requires {1}'.format(p.name, ', '.join(sorted(missing))))
+            available |= set(p.provides)
+        self.provides = available
+
+    @classmethod
+    def preview(cls):
+        """Pipeline with only the cheap passes, for showing the structure quickly"""
+        return cls([name for name in DEFAULT_PIPELINE if not PASSES[name].expensive])
+
+    def isComplete(self):
+        return all(set(PASSES[name].provides) <= self.provides for name in DEFAULT_PIPELINE)
+
+    def run(self, analysis):
+        content = None
+        for p in self.passes:
+            start = time.perf_counter()
+            content = p.run(analysis, content)
+            elapsed = time.perf_counter() - start
+            self.timings[p.name] = self.timings.get(p.name, 0.0) + elapsed
+            PASS_STATS.add(p.name, elapsed)
+        return content
@@ -14,6 +14,7 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+from array import array
 from collections import defaultdict
 from awake import address
 from awake.instruction import TailCall
@@ -189,6 +190,13 @@ def getLimit(proj, addr):
         return next_owned
 
 class ProcedureGraph(object):
+    """
+    Control flow graph of a procedure. Edges are kept in compressed sparse row form: childs of block x are
+    child_index[child_offsets[x]:child_offsets[x+1]], with the return vertex numbered numVertices(). Parents are
+    stored the same way, the return vertex getting the extra last slot. childs() and parents() hand out tuples
+    built from these once, with None standing for the return vertex.
+    """
+
     def __init__(self, proj, start_addr, end_addr, block_starts, jumptable_sizes):
         self.start_addr = start_addr
         self.end_addr = end_addr
@@ -197,11 +205,10 @@ class ProcedureGraph(object):
         self.block_starts = block_starts
         self.block_id_at_addr = dict((block_starts[i], i) for i in range(len(block_starts)))
         self.block_id_at_addr[None] = None
-        self._childs = dict()
         self.blocks = [None] * len(block_starts)
+        self._edges = [None] * len(block_starts)
         self.addBlocks(proj)
-        self._parents = defaultdict(list)
-        self._fillParents()
+        self._buildAdjacency()
 
     def addBlocks(self, proj):
         num_blocks = len(self.blocks)
@@ -223,7 +230,7 @@ class ProcedureGraph(object):
         self.blocks.append(Block([instr]))
 
         self.block_starts.append(addr)
-        self._childs[pos] = [None]
+        self._edges.append([None])
 
     def addBlock(self, proj, pos, start_addr, end_addr):
 
@@ -265,30 +272,61 @@ class ProcedureGraph(object):
         self.blocks[pos] = block
 
         for ch in childs:
-            if ch not in self.block_starts:
-                if ch is not None:
-                    self.addFakeBlock(proj, ch)
-
-        self._childs[self.block_id_at_addr[start_addr]] = [self.block_id_at_addr[ch] for ch in childs]
-
-    def _fillParents(self):
-        for x in self.vertices():
-            for ch in self.childs(x):
-                self._parents[ch].append(x)  # important: duplicate childs must be supported
+            if ch not in self.block_id_at_addr:
+                self.addFakeBlock(proj, ch)
+
+        self._edges[pos] = [self.block_id_at_addr[ch] for ch in childs]
+
+    def _buildAdjacency(self):
+        num_verts = len(self.blocks)
+        ret = num_verts
+
+        self.child_offsets = array('l', [0]) * (num_verts + 1)
+        self.child_index = array('l')
+        for x in range(num_verts):
+            self.child_index.extend(ret if ch is None else ch for ch in self._edges[x])
+            self.child_offsets[x+1] = len(self.child_index)
+        del self._edges
+
+        # counting sort by child
+        counts = array('l', [0]) * (num_verts + 2)
+        for ch in self.child_index:
+            counts[ch + 1] += 1
+        for i in range(num_verts + 1):
+            counts[i+1] += counts[i]
+        self.parent_offsets = array('l', counts)
+
+        # important: duplicate childs must be supported
+        self.parent_index = array('l', [0]) * len(self.child_index)
+        for x in range(num_verts):
+            for i in range(self.child_offsets[x], self.child_offsets[x+1]):
+                ch = self.child_index[i]
+                self.parent_index[counts[ch]] = x
+                counts[ch] += 1
+
+        self._childs = [tuple(None if ch == ret else ch for ch in self.child_index[self.child_offsets[x]:self.child_offsets[x+1]])
+                        for x in range(num_verts)]
+        self._parents = [tuple(self.parent_index[self.parent_offsets[x]:self.parent_offsets[x+1]])
+                         for x in range(num_verts + 1)]
 
     def start(self):
         return 0
 
+    def numVertices(self):
+        return len(self.blocks)
+
     def parents(self, x):
+        if x is None:
+            return self._parents[-1]
         return self._parents[x]
 
     def childs(self, x):
         if x is None:
-            return []
+            return ()
         return self._childs[x]
 
     def vertices(self):
-        return set(range(len(self.blocks)))
+        return range(len(self.blocks))
 
     def skipSimpleJumps(self, x):
         if x and not self.blocks[x] and len(self.childs(x)) == 1 and self.childs(x)[0] is None:
@@ -15,12 +15,14 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import os
+import threading
 import upgrade_database as updb
 from awake.database import Database
 from awake.disasm import Z80Disasm
 from awake.config import Config
 from awake.flow import ProcedureFlowCache
 from awake.rom import Rom
+from awake.scheduler import AnalysisScheduler
 from awake.debugsymbols import DebugSymbols
 
 class Project(object):
@@ -28,24 +30,32 @@ class Project(object):
     The main entry point into the application (called by main.py)
     """
 
-    def __init__(self, filename, config_file, config_is_object=False):
+    def __init__(self, filename, config_file, config_is_object=False, base=None):
         """
         Create a new Project with specified Rom Filename and configuration
         :type filename: str
+        :param base: Project to share the rom and opcode tables with (see openCopy)
         """
         self.filename = filename
-        self.rom = Rom(self.filename)
+        self.base = base
+        if base:
+            self.rom = base.rom
+        else:
+            self.rom = Rom(self.filename)
         if config_is_object:                #If configs passed as object [needed for openCopy()]
             self.config=config_file         #Use the objects
         else:                               #Otherwise, use the filenames.
             self.config = Config(config_file)
         romconfig=Config(filename, rom=True) # TODO: Doesn't this negate the purpose of the previous self.config lines?
-        if romconfig.get(['Database','Auto-Upgrade']):
+        if not base and romconfig.get(['Database','Auto-Upgrade']):
             updb.doUpgrade(self.filename)
         self.database = Database(self.filenameBase()+'.awakedb')
-        self.disasm = Z80Disasm(self)
+        self.romconfig = None  # (file stamp, Config), see romConfig
+        self.disasm = Z80Disasm(self, base.disasm if base else None)
         self.flow = ProcedureFlowCache(self)
         self.debug_symbols = None
+        self.scheduler = None
+        self.scheduler_lock = threading.Lock()
 
     def filenameBase(self):
         """
@@ -54,6 +64,21 @@ class Project(object):
         """
         return os.path.splitext(self.filename)[0]
 
+    def romConfig(self):
+        """
+        Config of the rom, read again only when its file changes
+        :return: Config
+        """
+        try:
+            stat = os.stat(self.filename + '.json')
+            stamp = (stat.st_mtime_ns, stat.st_size)
+        except OSError:
+            stamp = None
+        cached = self.romconfig
+        if cached is None or stamp is None or cached[0] != stamp:
+            cached = self.romconfig = (stamp, Config(self.filename, rom=True))
+        return cached[1]
+
     def importDebugSymbols(self, filename):
         print("Importing debug symbols. This may take a minute...")
         self.debug_symbols = DebugSymbols(filename, exclude_pattern='^label_*')
@@ -65,8 +90,24 @@ class Project(object):
         """
         Close the awakedb database when you finish using it
         """
+        self.flow.clear()
         self.database.close()
 
+    def analysisScheduler(self):
+        """
+        The AnalysisScheduler shared by the project and all its copies, started on first use.
+        """
+        root = self
+        while root.base:
+            root = root.base
+        with root.scheduler_lock:
+            if root.scheduler is None:
+                root.scheduler = AnalysisScheduler(root)
+            return root.scheduler
+
     def openCopy(self):
-        """Create a project mirror for safe use from different thread"""
-        return Project(self.filename, self.config, True)
+        """
+        Create a project mirror for safe use from different thread.
+        The copy has its own database connection and decoded instructions, the rom and opcode tables are shared.
+        """
+        return Project(self.filename, self.config, True, self)
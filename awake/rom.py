@@ -14,6 +14,7 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import hashlib
 import struct
 
 class Rom(object):
@@ -33,6 +34,15 @@ class Rom(object):
         with open(filename, 'rb') as f:
             # Read all the bytes into an internal variable called data
             self.data = f.read()
+        self._digest = None
+
+    def digest(self):
+        """
+        Returns the SHA-1 of the rom contents, identifying the rom in caches
+        """
+        if self._digest is None:
+            self._digest = hashlib.sha1(self.data).hexdigest()
+        return self._digest
 
     def get(self, address):
         """
@@ -0,0 +1,297 @@
+# This file is part of Awake - GB decompiler.
+# Copyright (C) 2014  Wojciech Marczenko (devdri) <wojtek.marczenko@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import threading
+import time
+import traceback
+from collections import deque
+from contextlib import contextmanager
+from awake.flow import update_info
+
+# priority classes, most urgent first
+INTERACTIVE = 0
+PREFETCH = 1
+BULK = 2
+
+class AnalysisError(Exception):
+    """Analysis of a proc of an AnalysisJob failed"""
+
+    def __init__(self, message, addr=None):
+        super(AnalysisError, self).__init__(message)
+        self.addr = addr
+
+class CancelToken(object):
+    """
+    Cancellation flag of a job. When tied to an AsyncTask, the token is also cancelled
+    by the task's requestCancel.
+    """
+
+    def __init__(self, task=None):
+        self.task = task
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+    def isCancelled(self):
+        return self.cancelled or (self.task is not None and self.task.requestCancel)
+
+class AnalysisJob(object):
+    """
+    Procs to analyze in background for one client (e.g. an export), in the given order.
+    :param token: CancelToken, a new one by default
+    :param update: Save the summaries (calls, registers used) of the analyzed procs to the database
+    """
+
+    def __init__(self, addrs, priority=BULK, token=None, update=False):
+        self.priority = priority
+        self.token = token or CancelToken()
+        self.update = update
+        self.todo = deque(addrs)
+        self.total = len(self.todo)
+        self.running = 0
+        self.done = 0
+        self.finished = set()  # analyzed procs, until the client takes them with AnalysisScheduler.waitFor
+        self.errors = dict()  # addr -> error message, for the finished procs whose analysis failed
+
+    def isFinished(self):
+        return self.token.isCancelled() or (not self.todo and not self.running)
+
+class AnalysisScheduler(object):
+    """
+    Analyzes procs on a bounded pool of worker threads shared by the server, GUI and export,
+    each worker with its own copy of the project. Results land in the flow store, from where
+    clients pick them up with ProcedureFlowCache.available() or uncached().
+
+    Work is taken by priority: procs requested by the UI first, then prefetching of procs the user
+    is likely to open next, then bulk jobs, which take turns proc by proc. Prefetch and bulk work
+    does not start while an interactive request is being served, and together they always leave one
+    worker free for interactive requests. Prefetching keeps to a bounded queue and a share of the CPU.
+    """
+
+    def __init__(self, proj):
+        self.base_proj = proj
+        self.condition = threading.Condition()
+        self.workers = []
+        self.projects = []  # project copies of the workers
+        self.stopped = False
+        self.active = 0  # procs being analyzed by the workers
+
+        config = proj.config
+        self.num_workers = max(1, config.get(['Scheduler', 'Workers']))
+
+        self.requests = deque()
+        self.pending = set()
+        self.finished = set()
+
+        self.prefetch_queue = deque(maxlen=config.get(['Prefetch', 'Queue-Size']))
+        self.cpu_share = config.get(['Prefetch', 'CPU-Share'])
+        self.warm_up = 0
+        self.resume_at = 0  # time.monotonic() before which prefetching waits, to keep within the CPU share
+        self.prefetched = 0
+
+        self.jobs = deque()  # bulk jobs, rotated to take turns
+        self.bulk_running = 0
+        self.prefetch_running = 0
+        self.interactive_count = 0
+
+    def ensureStarted(self):
+        if not self.workers and not self.stopped:
+            self.workers = [threading.Thread(target=self.work) for i in range(self.num_workers)]
+            for worker in self.workers:
+                worker.daemon = True
+                worker.start()
+
+    def request(self, addr):
+        """Queue the proc for analysis as soon as possible, unless it is already waiting"""
+        with self.condition:
+            if addr in self.pending:
+                return
+            self.pending.add(addr)
+            self.finished.discard(addr)
+            self.requests.append(addr)
+            self.ensureStarted()
+            self.condition.notify()
+
+    def prefetch(self, addrs):
+        """Queue procs for analysis when there is nothing more important to do, dropping the oldest ones if the queue is full"""
+        with self.condition:
+            for addr in sorted(addrs):
+                if addr.inPhysicalMem() and not addr.isAmbiguous() and addr not in self.prefetch_queue:
+                    self.prefetch_queue.append(addr)
+            self.ensureStarted()
+            self.condition.notify()
+
+    def warmUp(self):
+        """Prefetch the most called procs"""
+        with self.condition:
+            self.warm_up = self.base_proj.config.get(['Prefetch', 'Warm-Up'])
+            if self.warm_up:
+                self.ensureStarted()
+            self.condition.notify()
+
+    def submit(self, job):
+        """Run an AnalysisJob in background, returns the job"""
+        with self.condition:
+            self.jobs.append(job)
+            self.ensureStarted()
+            self.condition.notify_all()
+        return job
+
+    def waitFor(self, job, addr):
+        """
+        Wait until the job has analyzed addr, returns False if the job was cancelled first.
+        Raises AnalysisError if the analysis failed.
+        """
+        with self.condition:
+            while addr not in job.finished:
+                if job.token.isCancelled() or self.stopped:
+                    return False
+                self.condition.wait(0.1)
+            job.finished.discard(addr)
+            error = job.errors.pop(addr, None)
+        if error is not None:
+            raise AnalysisError('{0}: {1}'.format(addr, error), addr)
+        return True
+
+    @contextmanager
+    def interactive(self):
+        """Prefetch and bulk work do not start while any thread is inside this block"""
+        with self.condition:
+            self.interactive_count += 1
+        try:
+            yield
+        finally:
+            with self.condition:
+                self.interactive_count -= 1
+                self.condition.notify_all()
+
+    def waitQuiet(self, timeout):
+        """
+        Wait up to timeout seconds until no interactive request is queued, being analyzed or served,
+        returns whether there is none. For bulk work done outside the workers, like parallel export.
+        """
+        with self.condition:
+            if self.pending or self.interactive_count:
+                self.condition.wait(timeout)
+            return not (self.pending or self.interactive_count)
+
+    def isPending(self, addr):
+        with self.condition:
+            return addr in self.pending
+
+    def isReady(self, addr):
+        with self.condition:
+            return addr in self.finished
+
+    def stop(self):
+        with self.condition:
+            self.stopped = True
+            self.condition.notify_all()
+
+    def nextBulk(self):
+        """Next proc of the bulk job whose turn it is, or None"""
+        for i in range(len(self.jobs)):
+            job = self.jobs[0]
+            self.jobs.rotate(-1)
+            if job.token.isCancelled():
+                job.todo.clear()
+            if job.todo:
+                return job, job.todo.popleft()
+        self.jobs = deque(job for job in self.jobs if not job.isFinished())
+        return None
+
+    def nextProc(self):
+        """
+        Next proc to analyze, as (priority, job, addr), waits until there is one. None when stopped.
+        """
+        with self.condition:
+            while True:
+                if self.stopped:
+                    return None
+                if self.requests:
+                    self.active += 1
+                    return INTERACTIVE, None, self.requests.popleft()
+
+                delay = None
+                # prefetch and bulk work leave a worker free for interactive requests
+                background = self.prefetch_running + self.bulk_running
+                if not self.interactive_count and background < max(1, self.num_workers - 1):
+                    if self.prefetch_queue:
+                        delay = self.resume_at - time.monotonic()
+                        if delay <= 0:
+                            self.prefetch_running += 1
+                            self.active += 1
+                            return PREFETCH, None, self.prefetch_queue.popleft()
+                    bulk = self.nextBulk()
+                    if bulk:
+                        job, addr = bulk
+                        job.running += 1
+                        self.bulk_running += 1
+                        self.active += 1
+                        return BULK, job, addr
+                self.condition.wait(delay)
+
+    def work(self):
+        proj = self.base_proj.openCopy()
+        self.projects.append(proj)
+
+        with self.condition:
+            warm_up, self.warm_up = self.warm_up, 0
+        if warm_up:
+            self.prefetch(proj.database.getMostCalled(warm_up))
+
+        while True:
+            item = self.nextProc()
+            if item is None:
+                break
+            priority, job, addr = item
+
+            start = time.thread_time()
+            error = None
+            try:
+                if priority == INTERACTIVE:
+                    proj.flow.at(addr)
+                elif priority == BULK:
+                    proc = proj.flow.uncached(addr)  # stored for the client, without churning the cache
+                    if job.update:
+                        update_info(proc, proj.database)
+                elif proj.flow.available(addr) is None:
+                    proj.flow.at(addr)
+                    self.prefetched += 1
+            except Exception as e:
+                traceback.print_exc()
+                error = traceback.format_exception_only(type(e), e)[-1].strip()
+
+            with self.condition:
+                self.active -= 1
+                if priority == INTERACTIVE:
+                    self.pending.discard(addr)
+                    self.finished.add(addr)
+                elif priority == PREFETCH:
+                    self.prefetch_running -= 1
+                    used = time.thread_time() - start
+                    self.resume_at = time.monotonic() + used * (1 - self.cpu_share) / self.cpu_share
+                else:
+                    job.running -= 1
+                    job.done += 1
+                    job.finished.add(addr)
+                    if error is not None:
+                        job.errors[addr] = error
+                    self.bulk_running -= 1
+                self.condition.notify_all()
+
+        proj.close()
@@ -14,19 +14,58 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import cProfile
+import gzip
+import hashlib
+import io
+import json
+import marshal
+import pstats
 import queue
+import threading
+import time
+import zlib
 import tkinter as tk
 import tkinter.ttk
-import http.client
 import webbrowser
+from collections import OrderedDict
 from http.server import BaseHTTPRequestHandler, HTTPServer
 from urllib.parse import urlparse, parse_qs
 from awake import address, procedure
+from awake.api import ApiError, dispatchApi
+from awake.jobs import JobList
+from awake.metrics import RequestMetrics, renderMetrics, routeOf
 from awake.textrenderer import HtmlRenderer
 from awake.util import AsyncTask, getTkRoot
-from awake.pages import dispatchUrl
+from awake.pages import dispatchUrl, ProcedureFlowPage
 from awake.project import Project
 
+# served from memory, path -> (content type, file)
+STATIC_FILES = {
+    '/style.css': ('text/css', 'style.css'),
+    '/favicon.ico': ('image/x-icon', 'favicon.ico'),
+}
+STATIC_CACHE_CONTROL = 'public, max-age=86400'
+
+# smaller responses are sent uncompressed
+GZIP_MIN_SIZE = 1024
+
+# job progress events are sent at most this often, with a keep-alive comment when nothing changed for a while
+JOB_EVENT_INTERVAL = 0.25
+JOB_KEEP_ALIVE = 15
+
+FLOW_POLL_SCRIPT = """<script>
+(function poll() {{
+  fetch('/proc/{0}/flow').then(function(response) {{
+    if (response.status == 202) {{
+      setTimeout(poll, 200);
+    }} else if (response.ok) {{
+      response.text().then(function(text) {{ document.getElementById('page').innerHTML = text; }});
+    }}
+  }});
+}})();
+</script>"""
+
 def name_form(addr, database):
     out = ''
     out += '<form class="name-form" method="get" action="/set-name">'
@@ -36,82 +75,517 @@ def name_form(addr, database):
     out += '</form>'
     return out
 
+def refresh_form(url):
+    out = ''
+    out += '<form class="refresh-form" method="post" action="/refresh{0}">'.format(url)
+    out += '<input type="submit" value="reanalyze" />'
+    out += '</form>'
+    return out
+
+# sort orders accepted by the profile table
+PROFILE_SORTS = ('cumulative', 'tottime', 'ncalls', 'time')
+
+def is_jobs_url(url):
+    path = urlparse(url).path
+    return path == '/jobs' or path.startswith('/jobs/')
+
+class PageCache(object):
+    """
+    Rendered responses shared by the server threads, least recently used dropped first.
+    :param budget: Total size of the kept responses, in bytes
+    """
+
+    def __init__(self, budget):
+        self.budget = budget
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.size = 0
+
+    def get(self, key):
+        with self.lock:
+            body = self.entries.get(key)
+            if body is not None:
+                self.entries.move_to_end(key)
+            return body
+
+    def put(self, key, body):
+        with self.lock:
+            if key in self.entries:
+                return
+            self.entries[key] = body
+            self.size += len(body)
+            while self.size > self.budget and self.entries:
+                _, dropped = self.entries.popitem(last=False)
+                self.size -= len(dropped)
+
+class ChunkedResponse(object):
+    """
+    Writes a response body with HTTP/1.1 chunked transfer encoding, gzip-compressed if asked to.
+    A copy of the (uncompressed) body is kept in kept while it is within keep_limit bytes, else kept is None.
+    """
+
+    def __init__(self, wfile, compress=False, keep_limit=0):
+        self.wfile = wfile
+        self.compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS) if compress else None
+        self.keep_limit = keep_limit
+        self.kept = [] if keep_limit else None
+        self.kept_size = 0
+
+    def write(self, text):
+        data = text.encode()
+        if self.kept is not None:
+            self.kept_size += len(data)
+            if self.kept_size <= self.keep_limit:
+                self.kept.append(data)
+            else:
+                self.kept = None
+        if self.compressor:
+            data = self.compressor.compress(data) + self.compressor.flush(zlib.Z_SYNC_FLUSH)
+        self.writeChunk(data)
+
+    def writeChunk(self, data):
+        if data:
+            self.wfile.write('{0:X}\r\n'.format(len(data)).encode() + data + b'\r\n')
+
+    def close(self):
+        if self.compressor:
+            self.writeChunk(self.compressor.flush())
+        self.wfile.write(b'0\r\n\r\n')
+
 class Handler(BaseHTTPRequestHandler):
+    # needed for chunked responses
+    protocol_version = 'HTTP/1.1'
+
+    def handle_one_request(self):
+        start = time.perf_counter()
+        self.status = None
+        super(Handler, self).handle_one_request()
+        if self.status is not None:
+            route = '/static' if self.path in self.server.static else routeOf(self.path)
+            self.server.metrics.observe(route, self.status, time.perf_counter() - start)
+
+    def send_response(self, code, message=None):
+        self.status = code
+        super(Handler, self).send_response(code, message)
+        # one request per connection, so idle clients do not hold on to a worker thread
+        self.send_header('Connection', 'close')
 
     def redirect(self, where):
-        self.send_response(301)
+        # see other, browsers do not keep it, so repeating the action reaches the server again
+        self.send_response(303)
         self.send_header('Location', where)
+        self.send_header('Cache-Control', 'no-store')
+        self.send_header('Content-Length', '0')
         self.end_headers()
 
-    def ok_html(self):
+    def send_body(self, body, content_type, etag=None, cache_control='no-cache', status=200):
+        encoding = None
+        if len(body) >= GZIP_MIN_SIZE and 'gzip' in self.headers.get('Accept-Encoding', ''):
+            encoding = 'gzip'
+            zipped = self.server.pages.get((etag, encoding)) if etag else None
+            if zipped is None:
+                zipped = gzip.compress(body)
+                if etag:
+                    self.server.pages.put((etag, encoding), zipped)
+            body = zipped
+
+        self.send_response(status)
+        self.send_header('Content-type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Vary', 'Accept-Encoding')
+        if encoding:
+            self.send_header('Content-Encoding', encoding)
+        if etag:
+            self.send_header('ETag', etag)
+            self.send_header('Cache-Control', cache_control)
+        else:
+            self.send_header('Cache-Control', 'no-store')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def not_modified(self, etag):
+        """Answer a conditional request if the client has the current version, returns True if it did"""
+        if self.headers.get('If-None-Match') != etag:
+            return False
+        self.send_response(304)
+        self.send_header('ETag', etag)
+        self.end_headers()
+        return True
+
+    def flow_page(self, url):
+        """
+        Flow page, or a pending one after queueing its analysis in the background.
+        The procs it calls or is called from are prefetched.
+        """
+        page = ProcedureFlowPage(self.server.proj, url, True)
+        scheduler = self.server.scheduler
+        scheduler.prefetch(page.info.calls | page.info.tail_calls | page.info.callers)
+        if page.pending:
+            if scheduler.isReady(page.addr):
+                # analyzed in background, but the result did not make it to the store
+                return ProcedureFlowPage(self.server.proj, url)
+            scheduler.request(page.addr)
+        return page
+
+    def load_page(self, fragment):
+        if fragment:
+            return self.flow_page(self.path[:-len('/flow')])
+        if self.path.startswith('/proc/') and not self.path.endswith('/basic'):
+            return self.flow_page(self.path)
+        return dispatchUrl(self.server.proj, self.path)
+
+    def send_empty(self, status):
+        self.send_response(status)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def send_page(self):
+        etag = self.server.pageTag(self.path)
+        if self.not_modified(etag):
+            return
+
+        body = self.server.pages.get((etag, None))
+        if body is not None:
+            self.send_body(body, 'text/html;charset=utf-8', etag)
+            return
+
+        # the flow view alone, fetched by a pending page
+        fragment = self.path.startswith('/proc/') and self.path.endswith('/flow')
+        page = self.load_page(fragment)
+        if not page:
+            self.send_empty(404)
+            return
+        pending = getattr(page, 'pending', False)
+        if fragment and pending:
+            self.send_empty(202)
+            return
+        if pending:
+            # structure-only preview standing in for the flow, it will change once analyzed
+            etag = None
+
+        compress = 'gzip' in self.headers.get('Accept-Encoding', '')
         self.send_response(200)
         self.send_header('Content-type', 'text/html;charset=utf-8')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.send_header('Vary', 'Accept-Encoding')
+        if compress:
+            self.send_header('Content-Encoding', 'gzip')
+        if etag:
+            self.send_header('ETag', etag)
+            self.send_header('Cache-Control', 'no-cache')
+        else:
+            self.send_header('Cache-Control', 'no-store')
         self.end_headers()
 
+        out = ChunkedResponse(self.wfile, compress, self.server.pages.budget // 4 if etag else 0)
+        if not fragment:
+            out.write("<html><head><link rel=\"stylesheet\" type=\"text/css\" href=\"/style.css\" /></head><body>")
+            if page.has_name_form:
+                out.write(name_form(page.addr, self.server.proj.database))
+            if page.has_refresh:
+                out.write(refresh_form(self.path))
+            out.write("<div id=\"page\">")
+
+        renderer = HtmlRenderer(self.server.proj.database, out.write)
+        page.render(renderer)
+        renderer.finish()
+
+        if not fragment:
+            out.write("</div>")
+            if pending:
+                out.write(FLOW_POLL_SCRIPT.format(page.addr))
+            out.write("</body></html>")
+        out.close()
+
+        if out.kept is not None:
+            self.server.pages.put((etag, None), b''.join(out.kept))
+
+    def send_api(self):
+        etag = self.server.pageTag(self.path)
+        if self.not_modified(etag):
+            return
+
+        body = self.server.pages.get((etag, None))
+        if body is None:
+            try:
+                body = json.dumps(dispatchApi(self.server.proj, self.path)).encode()
+            except ApiError as e:
+                self.send_body(json.dumps(dict(error=str(e))).encode(), 'application/json', status=e.status)
+                return
+            self.server.pages.put((etag, None), body)
+
+        self.send_body(body, 'application/json', etag)
+
+    def send_json(self, data, status=200):
+        self.send_body(json.dumps(data).encode(), 'application/json', status=status)
+
+    def send_job_events(self, job):
+        """Stream the job progress as server-sent events until it ends or the client goes away"""
+        streams = self.server.event_streams
+        if not streams.acquire(False):
+            # every stream holds a server thread, some must be left for pages
+            self.send_json(dict(error='too many event streams'), 503)
+            return
+        try:
+            self.send_response(200)
+            self.send_header('Content-type', 'text/event-stream')
+            self.send_header('Cache-Control', 'no-store')
+            self.end_headers()
+            version = None
+            while True:
+                changed = job.waitChange(version, JOB_KEEP_ALIVE)
+                if changed == version:
+                    self.wfile.write(b': keep-alive\n\n')
+                else:
+                    version = changed
+                    snapshot = job.snapshot()
+                    event = 'progress' if snapshot['state'] == 'running' else 'end'
+                    self.wfile.write('event: {0}\ndata: {1}\n\n'.format(event, json.dumps(snapshot)).encode())
+                    if event == 'end':
+                        break
+                self.wfile.flush()
+                time.sleep(JOB_EVENT_INTERVAL)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        finally:
+            streams.release()
+
+    def do_jobs(self, method):
+        """
+        GET /jobs lists the background jobs, GET /jobs/<id> shows one, GET /jobs/<id>/events streams its progress.
+        POST /jobs?kind=analyze|discover|export&scope=all|bank|proc&bank=<hex>&addr=<addr>&mode=<export mode> submits one,
+        POST /jobs/<id>/cancel cancels it.
+        """
+        jobs = self.server.jobs
+        url = urlparse(self.path)
+        parts = url.path.strip('/').split('/')
+        try:
+            if method == 'GET' and len(parts) == 1:
+                self.send_json(dict(items=[job.snapshot() for job in jobs.all()]))
+            elif method == 'GET' and len(parts) == 2:
+                self.send_json(jobs.get(parts[1]).snapshot())
+            elif method == 'GET' and len(parts) == 3 and parts[2] == 'events':
+                self.send_job_events(jobs.get(parts[1]))
+            elif method == 'POST' and len(parts) == 1:
+                params = parse_qs(url.query)
+                length = int(self.headers.get('Content-Length') or 0)
+                if length:
+                    params.update(parse_qs(self.rfile.read(length).decode()))
+                kind = params.get('kind', [''])[0]
+                job = jobs.submit(kind, params)
+                self.send_json(job.snapshot(), 201)
+            elif method == 'POST' and len(parts) == 3 and parts[2] == 'cancel':
+                job = jobs.get(parts[1])
+                job.cancel()
+                self.send_json(job.snapshot())
+            else:
+                raise ApiError(404, 'not found')
+        except ApiError as e:
+            self.send_json(dict(error=str(e)), e.status)
+
+    def send_profile(self):
+        """
+        Load and render the page under cProfile, without any caching on the way, and send the hot functions.
+        ?profile=table (the default) sends them as a sorted text table, with sort=cumulative|tottime|ncalls and limit=<n>,
+        ?profile=raw sends the stats file for pstats or snakeviz. With reanalyze=1 flow pages analyze the proc again.
+        Only when Server/Profiling is on in the config.
+        """
+        if not self.server.proj.config.get(['Server', 'Profiling']):
+            self.send_empty(403)
+            return
+
+        url = urlparse(self.path)
+        params = parse_qs(url.query)
+        def param(name, default):
+            return params.get(name, [default])[0]
+        mode = param('profile', 'table') or 'table'
+        sort = param('sort', 'cumulative')
+        if mode not in ('table', 'raw') or sort not in PROFILE_SORTS:
+            self.send_empty(400)
+            return
+        try:
+            limit = int(param('limit', '40'))
+        except ValueError:
+            self.send_empty(400)
+            return
+
+        proj = self.server.proj
+        profiler = cProfile.Profile()
+        # one profiler at a time in the process
+        with self.server.profile_lock:
+            start = time.perf_counter()
+            profiler.enable()
+            try:
+                page = dispatchUrl(proj, url.path)
+                if page and param('reanalyze', '') == '1':
+                    page.refresh()
+                loaded = time.perf_counter()
+                if page:
+                    renderer = HtmlRenderer(proj.database, lambda text: None)
+                    page.render(renderer)
+                    renderer.finish()
+            finally:
+                profiler.disable()
+            rendered = time.perf_counter()
+
+        if not page:
+            self.send_empty(404)
+            return
+
+        profiler.create_stats()
+        if mode == 'raw':
+            self.send_response(200)
+            body = marshal.dumps(profiler.stats)
+            self.send_header('Content-type', 'application/octet-stream')
+            self.send_header('Content-Disposition', 'attachment; filename="awake.prof"')
+            self.send_header('Content-Length', str(len(body)))
+            self.send_header('Cache-Control', 'no-store')
+            self.end_headers()
+            self.wfile.write(body)
+            return
+
+        out = io.StringIO()
+        out.write('{0}\nload {1:.4f} s, render {2:.4f} s\n\n'.format(url.path, loaded - start, rendered - loaded))
+        pstats.Stats(profiler, stream=out).sort_stats(sort).print_stats(limit)
+        self.send_body(out.getvalue().encode(), 'text/plain;charset=utf-8')
+
+    def send_static(self, path):
+        content_type, data, etag = self.server.static[path]
+        if self.not_modified(etag):
+            return
+        self.send_body(data, content_type, etag, STATIC_CACHE_CONTROL)
+
     def do_GET(self):
 
         print(('get', self.path))
 
+        if self.path in self.server.static:
+            self.send_static(self.path)
+            return
 
-        page = dispatchUrl(self.server.proj, self.path)
-        if page:
+        if is_jobs_url(self.path):
+            # not interactive, an event stream would hold off background work for as long as it runs
+            self.do_jobs('GET')
+            return
 
-            self.ok_html()
-            self.wfile.write("<html><head><link rel=\"stylesheet\" type=\"text/css\" href=\"/style.css\" /></head><body>".encode())
+        if self.path == '/metrics':
+            self.send_body(renderMetrics(self.server).encode(), 'text/plain; version=0.0.4; charset=utf-8')
+            return
 
-            if page.has_name_form:
-                self.wfile.write(name_form(page.addr, self.server.proj.database).encode())
+        # prefetching in background waits until the request is served
+        with self.server.scheduler.interactive():
 
-            renderer = HtmlRenderer(self.server.proj.database)
+            if self.path.startswith('/set-name?'):
+                q = urlparse(self.path).query
+                p = parse_qs(q)
+                print((p, q))
+                addr = address.fromConventional(p['addr'][0])
+                name = p['name'][0]
+                self.server.proj.database.setNameForAddress(addr, name)
+                self.redirect(self.headers['Referer'])
 
-            page.load()
-            page.render(renderer)
+            elif self.path.startswith('/api/'):
+                self.send_api()
 
-            self.wfile.write(renderer.getContents().encode())
+            elif 'profile' in parse_qs(urlparse(self.path).query, keep_blank_values=True):
+                self.send_profile()
 
-            self.wfile.write("</body></html>".encode())
+            else:
+                self.send_page()
 
-        elif self.path == '/style.css':
-            self.send_response(200)
-            self.send_header('Content-type', 'text/css')
-            self.end_headers()
-            with open('style.css', 'rb') as f:
-                self.wfile.write(f.read())
+    def do_POST(self):
+        if is_jobs_url(self.path):
+            self.do_jobs('POST')
 
-        elif self.path == '/favicon.ico':
-            self.send_response(200)
-            self.send_header('Content-type', 'image/x-icon')
-            self.end_headers()
-            with open('favicon.ico', 'rb') as f:
-                self.wfile.write(f.read())
-
-        elif self.path.startswith('/set-name?'):
-            q = urlparse(self.path).query
-            p = parse_qs(q)
-            print((p, q))
-            addr = address.fromConventional(p['addr'][0])
-            name = p['name'][0]
-            self.server.proj.database.setNameForAddress(addr, name)
-            self.redirect(self.headers['Referer'])
-
-        elif self.path == '/quit/':
-            self.server.request_stop = True
-            self.send_response(200)
-            self.end_headers()
+        elif self.path.startswith('/refresh/'):
+            url = self.path[len('/refresh'):]
+            with self.server.scheduler.interactive():
+                page = dispatchUrl(self.server.proj, url, True)
+                if page:
+                    page.refresh()
+            self.redirect(url)
 
         else:
-            self.send_response(404)
-            self.end_headers()
+            self.send_empty(404)
 
     def address_string(self):
         # fix for slow reverse lookup on Windows
         return self.client_address[0]
 
-class StoppableHTTPServer(HTTPServer):
-    def serve_forever(self):
-        self.request_stop = False
-        while not self.request_stop:
-            self.handle_request()
+def loadStaticFiles():
+    static = dict()
+    for path, (content_type, filename) in STATIC_FILES.items():
+        try:
+            with open(filename, 'rb') as f:
+                data = f.read()
+        except IOError:
+            continue
+        static[path] = (content_type, data, '"{0}"'.format(hashlib.sha1(data).hexdigest()))
+    return static
+
+class ThreadPoolHTTPServer(HTTPServer):
+    """
+    Handles requests on a fixed pool of worker threads, each with its own copy of the project
+    (and so its own database connection). Call shutdown() from another thread to stop serve_forever(),
+    then server_close() lets the workers finish the requests they already accepted.
+    """
+
+    def __init__(self, server_address, handler, proj, num_workers=4, page_cache_size=16*1024*1024):
+        super(ThreadPoolHTTPServer, self).__init__(server_address, handler)
+        self.base_proj = proj
+        self.pages = PageCache(page_cache_size)
+        self.static = loadStaticFiles()
+        self.local = threading.local()
+        self.projects = []  # project copies of the workers
+        self.metrics = RequestMetrics()
+        self.profile_lock = threading.Lock()
+        self.jobs = JobList(proj)
+        self.event_streams = threading.BoundedSemaphore(max(1, num_workers - 1))
+        self.requests = queue.Queue()
+        self.workers = [threading.Thread(target=self.serveRequests) for i in range(num_workers)]
+        for worker in self.workers:
+            worker.daemon = True
+            worker.start()
+
+    @property
+    def proj(self):
+        """Project copy of the current worker thread"""
+        return self.local.proj
+
+    def pageTag(self, path):
+        """
+        ETag of a rendered page. It changes with the rom, the rom config (which, with the proc limits,
+        make up the flow cache key) and the names and proc summaries in the database.
+        """
+        proj = self.proj
+        key = (path, proj.rom.digest(), proj.romConfig().version(), proj.database.version('names'), proj.database.version('procs'))
+        return '"{0}"'.format(hashlib.sha1(repr(key).encode()).hexdigest())
+
+    def serveRequests(self):
+        self.local.proj = self.base_proj.openCopy()
+        self.projects.append(self.local.proj)
+        while True:
+            item = self.requests.get()
+            if item is None:
+                break
+            request, client_address = item
+            try:
+                self.finish_request(request, client_address)
+            except Exception:
+                self.handle_error(request, client_address)
+            finally:
+                self.shutdown_request(request)
+        self.local.proj.close()
+
+    def process_request(self, request, client_address):
+        self.requests.put((request, client_address))
+
+    def server_close(self):
+        super(ThreadPoolHTTPServer, self).server_close()
+        for worker in self.workers:
+            self.requests.put(None)
+        for worker in self.workers:
+            worker.join()
 
 class ServerTask(AsyncTask):
     def __init__(self, proj, port=8888):
@@ -123,24 +597,29 @@ class ServerTask(AsyncTask):
     def work(self):
         self.report("Loading project")
 
-        proj = self.base_proj.openCopy()
-
-        self.server = StoppableHTTPServer(('', self.port), Handler)
-        self.server.proj = proj
+        config = self.base_proj.config
+        page_cache_size = config.get(['Server', 'Page-Cache-MB']) * 1024 * 1024
+        server = ThreadPoolHTTPServer(('', self.port), Handler, self.base_proj, config.get(['Server', 'Threads']), page_cache_size)
+        scheduler = self.base_proj.analysisScheduler()
+        scheduler.warmUp()
+        server.scheduler = scheduler
+        self.server = server
         self.report("Running server on port {0}...".format(self.port))
         self.report("Please open url http://127.0.0.1:{0}/proc/100".format(self.port))
-        self.server.serve_forever()
-
-        proj.close()
+        try:
+            server.serve_forever()
+        finally:
+            self.report("Stopping server...")
+            server.jobs.cancelAll()
+            server.server_close()
 
         self.report("Server stopped.")
 
     def stop(self):
-        if self.server:
-            connection = http.client.HTTPConnection("127.0.0.1", self.port)
-            connection.request('GET', '/quit/')
-            connection.getresponse()
+        server = self.server
+        if server:
             self.server = None
+            server.shutdown()
 
 class LogFrame(tkinter.ttk.Frame):
     def __init__(self, parent):
@@ -0,0 +1,56 @@
+# This file is part of Awake - GB decompiler.
+# Copyright (C) 2012  Wojciech Marczenko (devdri) <wojtek.marczenko@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import unittest
+from . import address, api
+from .database import Database
+
+class FakeProject(object):
+    def __init__(self):
+        self.database = Database(':memory:')
+
+class Test(unittest.TestCase):
+
+    def setUp(self):
+        self.proj = FakeProject()
+        self.addrs = [address.fromVirtual(0x100 + 0x10 * i) for i in range(5)]
+        for i, addr in enumerate(self.addrs):
+            info = self.proj.database.procInfo(addr)
+            info.length = i
+            if i:
+                info.calls = set([self.addrs[i - 1]])
+            info.save(self.proj.database.connection)
+
+    def testPagedProcs(self):
+        items = []
+        cursor = ''
+        while cursor is not None:
+            page = api.dispatchApi(self.proj, '/api/procs?limit=2&fields=addr,calls,callers&cursor=' + cursor)
+            items += page['items']
+            cursor = page['next']
+        self.assertEqual([x['addr'] for x in items], [str(x) for x in self.addrs])
+        self.assertEqual(set(items[0]), set(['addr', 'calls', 'callers']))
+        self.assertEqual(items[1]['calls'], [str(self.addrs[0])])
+        self.assertEqual(items[1]['callers'], [str(self.addrs[2])])
+
+    def testProc(self):
+        item = api.dispatchApi(self.proj, '/api/proc/{0}?fields=length'.format(self.addrs[3]))
+        self.assertEqual(item, dict(length=3))
+        with self.assertRaises(api.ApiError):
+            api.dispatchApi(self.proj, '/api/procs?fields=nope')
+
+if __name__ == "__main__":
+    unittest.main()
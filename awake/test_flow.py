@@ -0,0 +1,287 @@
+# This file is part of Awake - GB decompiler.
+# Copyright (C) 2012  Wojciech Marczenko (devdri) <wojtek.marczenko@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import threading
+import time
+import unittest
+from collections import defaultdict
+from . import address, depend, flow, passes
+from .context import Context
+from .flowcontrol import Block
+from .instruction import Instruction
+from .operand import Condition
+from .regutil import ALL_REGS
+from .textrenderer import PlainTextRenderer
+
+class FakeGraph(object):
+    def __init__(self, edges):
+        self._childs = defaultdict(list)
+        self._parents = defaultdict(list)
+        self.num_verts = 0
+        for x, ch in edges:
+            self._childs[x].append(ch)
+            self.num_verts = max(self.num_verts, x + 1, (ch or 0) + 1)
+        for x in range(self.num_verts):
+            for ch in self._childs[x]:
+                self._parents[ch].append(x)
+
+    def start(self):
+        return 0
+
+    def childs(self, x):
+        if x is None:
+            return []
+        return self._childs[x]
+
+    def parents(self, x):
+        return self._parents[x]
+
+    def vertices(self):
+        return range(self.num_verts)
+
+class FakeJump(Instruction):
+    def __init__(self, addr):
+        super(FakeJump, self).__init__('JP', addr)
+        self.cond = Condition('FZ')
+
+class StructGraph(FakeGraph):
+    """FakeGraph with a NOP in every block and a conditional jump ending each fork"""
+
+    def __init__(self, edges):
+        super(StructGraph, self).__init__(edges)
+        self.block_starts = [address.fromVirtual(0x4000 + x) for x in range(self.num_verts)]
+
+    def skipSimpleJumps(self, x):
+        return x
+
+    def isSwitch(self, x):
+        return False
+
+    def getContents(self, x):
+        addr = self.block_starts[x]
+        if len(self.childs(x)) > 1:
+            return [Instruction('NOP', addr), FakeJump(addr)]
+        return [Instruction('NOP', addr)]
+
+    def getLast(self, x):
+        return self.getContents(x)[-1]
+
+    def getCondition(self, x):
+        return self.getLast(x).cond
+
+class FakeProject(object):
+    filename = None
+
+class FakeDatabase(object):
+    def nameForAddress(self, addr):
+        return str(addr)
+
+class SizedFlow(object):
+    size_estimate = 100
+    content = Block([], False)
+
+class CacheProject(object):
+    """Project with just enough for ProcedureFlowCache to insert and drop entries"""
+
+    def __init__(self, base=None, budget=None):
+        self.base = base
+        self.disasm = self
+        self.flow = flow.ProcedureFlowCache(self, budget)
+
+    def forget(self, addr):
+        pass
+
+class Test(unittest.TestCase):
+
+    def structure(self, edges):
+        graph = StructGraph(edges)
+        analysis = flow.FlowAnalysis(FakeProject(), address.fromVirtual(0x4000), graph)
+        content = analysis.process(graph.start(), None, False, False, True)
+        content = content.optimizedWithContext(Context())
+        content = content.optimizeDependencies(set(ALL_REGS))
+        content.render(PlainTextRenderer(FakeDatabase()))
+        self.assertTrue(content.complexity() > 0)
+        out = set()
+        content.getInstructions(out)
+        return out
+
+    def testReversePostorder(self):
+        g = FakeGraph([(0, 1), (0, 2), (1, 3), (2, 3), (3, None)])
+        self.assertEqual(flow.reverse_postorder(g), [0, 2, 1, 3, None])
+
+    def testMergeIfElse(self):
+        g = FakeGraph([(0, 1), (0, 2), (1, 3), (2, 3), (3, None)])
+        self.assertEqual(flow.find_merge_points(g)[0], set([3]))
+
+    def testMergeEarlyReturn(self):
+        g = FakeGraph([(0, 1), (0, 2), (1, 4), (2, 3), (2, None), (3, 4), (4, None)])
+        merges = flow.find_merge_points(g)
+        self.assertEqual(merges[0], set([4]))
+        self.assertEqual(merges[2], set())
+
+    def testMergeLoop(self):
+        g = FakeGraph([(0, 1), (1, 2), (1, 3), (2, 1), (3, None)])
+        # the loop branch cannot pass through its own fork again, so it never merges with the exit
+        self.assertEqual(flow.find_merge_points(g)[1], set())
+
+    def testNestedLoops(self):
+        g = FakeGraph([(0, 1), (1, 2), (2, 3), (2, 2), (3, 1), (3, 4), (4, None)])
+        loops = flow.LoopForest(g)
+        self.assertEqual(loops.headers, set([1, 2]))
+        self.assertEqual(loops.innermost(3), 1)
+        self.assertEqual(loops.members(1), set([1, 2, 3]))
+        self.assertEqual(loops.members(2), set([2]))
+        self.assertEqual(loops.take_unused(1), set([1, 2, 3]))
+        self.assertEqual(loops.take_unused(1), None)
+        loops.visit(1)
+        self.assertEqual(loops.take_unused(2), set([2]))
+
+    def testDeepIfNesting(self):
+        depth = 2000
+        edges = [(i, i + 1) for i in range(depth)] + [(i, depth) for i in range(depth - 1)] + [(depth, None)]
+        instructions = self.structure(edges)
+        self.assertEqual(sum(1 for x in instructions if x.name == 'if'), depth - 1)
+
+    def testDeepLoopNesting(self):
+        depth = 600
+        # entry chain 0..depth-1 into latches, latch of loop i jumps back to i or falls out to the next latch
+        latch = lambda i: 2 * depth - 1 - i
+        edges = [(i, i + 1) for i in range(depth)]
+        for i in range(depth):
+            edges += [(latch(i), i), (latch(i), latch(i - 1) if i else None)]
+        instructions = self.structure(edges)
+        self.assertEqual(sum(1 for x in instructions if x.name in ('while', 'do-while')), depth)
+
+    def testPassPipeline(self):
+        self.assertRaises(ValueError, passes.PassManager, ['context'])
+        self.assertFalse(passes.PassManager.preview().isComplete())
+
+        graph = StructGraph([(0, 1), (0, 2), (1, 3), (2, 3), (3, None)])
+        analysis = flow.FlowAnalysis(FakeProject(), address.fromVirtual(0x4000), graph)
+        manager = passes.PassManager(['structure', 'dependencies'])
+        runs = dict((name, n) for name, n, seconds in passes.PASS_STATS.snapshot())
+        content = manager.run(analysis)
+        self.assertEqual(list(manager.timings), ['structure', 'dependencies'])
+        after = dict((name, n) for name, n, seconds in passes.PASS_STATS.snapshot())
+        self.assertEqual(after['structure'], runs.get('structure', 0) + 1)
+        self.assertTrue(content.complexity() > 0)
+
+    def testSingleFlight(self):
+        flights = flow.SingleFlight()
+        started = threading.Event()
+        release = threading.Event()
+        store = []
+
+        def work():
+            if not store:
+                started.set()
+                release.wait()
+                store.append(object())
+            return store[0]
+
+        results = []
+        leader = threading.Thread(target=lambda: results.append(flights.run('key', work)))
+        leader.start()
+        started.wait()
+        follower = threading.Thread(target=lambda: results.append(flights.run('key', work, lambda: store[0])))
+        follower.start()
+        while not flights.coalesced:
+            time.sleep(0.001)
+        release.set()
+        leader.join()
+        follower.join()
+
+        self.assertEqual(len(store), 1)
+        self.assertEqual(sorted(waited for _, waited in results), [False, True])
+        self.assertIs(results[0][0], results[1][0])
+        self.assertEqual(flights.flights, {})
+
+    def testSingleFlightFailure(self):
+        flights = flow.SingleFlight()
+        started = threading.Event()
+        release = threading.Event()
+        store = []
+        runs = []
+
+        def work():
+            runs.append(1)
+            if len(runs) == 1:
+                started.set()
+                release.wait()
+                raise ValueError('failed')
+            store.append(object())
+            return store[0]
+
+        def lookup():
+            return store[0] if store else None
+
+        def failing():
+            with self.assertRaises(ValueError):
+                flights.run('key', work, lookup)
+
+        results = []
+        leader = threading.Thread(target=failing)
+        leader.start()
+        started.wait()
+        followers = [threading.Thread(target=lambda: results.append(flights.run('key', work, lookup))) for i in range(4)]
+        for follower in followers:
+            follower.start()
+        while flights.coalesced < 4:
+            time.sleep(0.001)
+        release.set()
+        leader.join()
+        for follower in followers:
+            follower.join()
+
+        self.assertEqual(len(runs), 2)
+        self.assertEqual(len(results), 4)
+        self.assertTrue(all(proc is store[0] and waited for proc, waited in results))
+        self.assertEqual(flights.flights, {})
+
+    def testSharedBudget(self):
+        base = CacheProject(budget=250)
+        copy = CacheProject(base)
+        self.assertIs(copy.flow.budget, base.flow.budget)
+        addrs = [address.fromVirtual(0x4000 + i) for i in range(4)]
+        base.flow._insert(addrs[0], None, SizedFlow())
+        base.flow._insert(addrs[1], None, SizedFlow())
+        copy.flow._insert(addrs[2], None, SizedFlow())
+        self.assertEqual(len(copy.flow.cache), 1)  # the newest entry is always kept
+        base.flow._insert(addrs[3], None, SizedFlow())
+        self.assertEqual(list(base.flow.cache), [addrs[3]])
+        self.assertEqual(base.flow.budget.size, 200)
+        copy.flow.clear()
+        self.assertEqual(base.flow.budget.size, 100)
+
+    def testDependencyGenerations(self):
+        depend.invalidateDependencies()
+        mine = depend.dependencyGeneration()
+        theirs = []
+
+        def other():
+            depend.invalidateDependencies()
+            theirs.append(depend.dependencyGeneration())
+
+        thread = threading.Thread(target=other)
+        thread.start()
+        thread.join()
+        self.assertEqual(depend.dependencyGeneration(), mine)
+        self.assertNotEqual(theirs[0], mine)
+        depend.invalidateDependencies()
+        self.assertNotIn(depend.dependencyGeneration(), (mine, theirs[0]))
+
+if __name__ == "__main__":
+    unittest.main()
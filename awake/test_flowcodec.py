@@ -0,0 +1,73 @@
+# This file is part of Awake - GB decompiler.
+# Copyright (C) 2012  Wojciech Marczenko (devdri) <wojtek.marczenko@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import json
+import unittest
+import zlib
+from . import address, flowcodec
+from .flowcontrol import Block, Goto, Label
+from .instruction import Instruction
+from .operand import Register
+
+class Unlisted(object):
+    pass
+
+class Test(unittest.TestCase):
+
+    def setUp(self):
+        self.codec = flowcodec.FlowCodec(flowcodec.IR_LAYOUTS)
+
+    def testRoundTrip(self):
+        addr = address.fromVirtual(0x4000)
+        label = Label(addr)
+        block = Block([label, Instruction('NOP', addr), Goto(label)], False)
+        copy = self.codec.decode(self.codec.encode(block))
+        self.assertEqual([x.name for x in copy.contents], ['label', 'NOP', 'goto'])
+        self.assertEqual(copy.contents[1].addr, addr)
+        self.assertIs(copy.contents[2].target_label, copy.contents[0])
+        self.assertEqual(copy.contents[0].gotos, set([copy.contents[2]]))
+        self.assertEqual(copy.contents[0].needed, label.needed)
+
+    def testDeepNesting(self):
+        depth = 20000
+        block = Block([], False)
+        for i in range(depth):
+            block = Block([block], False)
+        copy = self.codec.decode(self.codec.encode(block))
+        for i in range(depth):
+            copy = copy.contents[0]
+        self.assertEqual(copy.contents, [])
+
+    def testUnlisted(self):
+        self.assertRaises(flowcodec.FlowCodecError, self.codec.encode, Block([Unlisted()], False))
+        reg = Register('A')
+        reg.extra = 1
+        self.assertRaises(flowcodec.FlowCodecError, self.codec.encode, reg)
+
+    def testRefusesForeignData(self):
+        data = self.codec.encode(Register('A'))
+        other = flowcodec.FlowCodec(flowcodec.IR_LAYOUTS[1:])
+        self.assertRaises(flowcodec.FlowCodecError, other.decode, data)
+
+        def forged(records):
+            return data[:flowcodec.HEADER.size] + zlib.compress(json.dumps(records).encode('utf-8'))
+
+        self.assertEqual(self.codec.decode(forged([[self.codec.classes.index(Register), 'B']])).name, 'B')
+        for records in ([], [[len(self.codec.classes)]], [['x']], [['l', [1]]], [['t', [0]]], [[-1]]):
+            self.assertRaises(flowcodec.FlowCodecError, self.codec.decode, forged(records))
+
+if __name__ == '__main__':
+    unittest.main()
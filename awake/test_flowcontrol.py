@@ -0,0 +1,36 @@
+# This file is part of Awake - GB decompiler.
+# Copyright (C) 2012  Wojciech Marczenko (devdri) <wojtek.marczenko@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import unittest
+from . import address, flowcontrol
+from .operand import Condition
+
+class Test(unittest.TestCase):
+
+    def testMemoizedDependencySet(self):
+        label = flowcontrol.Label(address.fromVirtual(0x4000))
+        inner = flowcontrol.Block([flowcontrol.Goto(label)])
+        block = flowcontrol.Block([flowcontrol.If(address.fromVirtual(0x4000), Condition('FZ'), inner, None)])
+
+        first = block.getDependencySet()
+        self.assertIs(block.getDependencySet(), first)
+
+        label.optimizeDependencies(set(['A']))
+        self.assertEqual(block.getDependencySet().reads, set(['A', 'FZ']))
+        self.assertEqual(block.getDependencies(set()), set(['A', 'FZ']))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,89 @@
+# This file is part of Awake - GB decompiler.
+# Copyright (C) 2012  Wojciech Marczenko (devdri) <wojtek.marczenko@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import unittest
+from .api import ApiError
+from .jobs import AnalysisTask, Job, makeTask
+from .util import AsyncTask
+
+class CountingTask(AsyncTask):
+    def work(self):
+        for i in range(3):
+            self.current = i
+            self.report(i, 3, 'step')
+        self.current = None
+        self.report(3, 3, 'Done!')
+
+class BrokenDatabase(object):
+    def getAll(self):
+        raise IOError('database is gone')
+
+class CopyProject(object):
+    def __init__(self):
+        self.database = BrokenDatabase()
+        self.closed = False
+
+    def openCopy(self):
+        return self
+
+    def analysisScheduler(self):
+        return None
+
+    def close(self):
+        self.closed = True
+
+class Test(unittest.TestCase):
+
+    def testProgress(self):
+        job = Job('1', 'count', CountingTask())
+        job.work()
+        snapshot = job.snapshot()
+        self.assertEqual(snapshot['state'], 'finished')
+        self.assertEqual((snapshot['done'], snapshot['total']), (3, 3))
+        self.assertIsNone(snapshot['eta'])
+        self.assertIsNone(snapshot['current'])
+
+    def testCancelled(self):
+        task = CountingTask()
+        job = Job('1', 'count', task)
+        job.report(1, 3, 'step')
+        job.cancel()
+        self.assertTrue(task.requestCancel)
+
+    def testCancelledBeforeStart(self):
+        task = CountingTask()
+        job = Job('1', 'count', task)
+        job.cancel()
+        job.work()
+        snapshot = job.snapshot()
+        self.assertEqual(snapshot['state'], 'cancelled')
+        self.assertEqual(snapshot['done'], 0)
+        self.assertTrue(task.requestCancel)
+
+    def testFailedAnalysisClosesCopy(self):
+        proj = CopyProject()
+        job = Job('1', 'analyze', AnalysisTask(proj))
+        job.work()
+        self.assertEqual(job.snapshot()['state'], 'failed')
+        self.assertTrue(proj.closed)
+
+    def testBadParams(self):
+        for kind, params in (('bogus', {}), ('analyze', {'scope': ['bank']}), ('export', {'mode': ['pdf']})):
+            with self.assertRaises(ApiError):
+                makeTask(None, kind, params)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,50 @@
+# This file is part of Awake - GB decompiler.
+# Copyright (C) 2012  Wojciech Marczenko (devdri) <wojtek.marczenko@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import tempfile
+import unittest
+from . import address
+from .database import Database
+from .manifest import ExportManifest, NameRecorder
+
+class Test(unittest.TestCase):
+
+    def testNameRecorder(self):
+        database = Database(':memory:')
+        addr = address.fromVirtual(0x150)
+        database.setNameForAddress(addr, 'start')
+        names = NameRecorder(database)
+        self.assertEqual(names.nameForAddress(addr), 'start')
+        self.assertEqual(names.names, {str(addr): 'start'})
+        self.assertFalse(names.hasNameForAddress(address.fromVirtual(0x160)))
+
+    def testRoundTrip(self):
+        addr = address.fromVirtual(0x150)
+        manifest = ExportManifest('flow')
+        manifest.add(addr, 0, b'text', dict(key='k', summaries={}, names={}))
+        with tempfile.TemporaryDirectory() as d:
+            filename = os.path.join(d, 'out.manifest')
+            manifest.save(filename)
+            self.assertEqual(ExportManifest.load(filename, 'flow').entries, manifest.entries)
+            self.assertEqual(ExportManifest.load(filename, 'basic').entries, {})
+            with open(os.path.join(d, 'out'), 'wb') as f:
+                f.write(b'text')
+            with open(os.path.join(d, 'out'), 'rb') as f:
+                self.assertEqual(manifest.read(f, addr), b'text')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,42 @@
+# This file is part of Awake - GB decompiler.
+# Copyright (C) 2012  Wojciech Marczenko (devdri) <wojtek.marczenko@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import unittest
+from .metrics import Histogram, MetricsText, routeOf
+
+class Test(unittest.TestCase):
+
+    def testRoutes(self):
+        self.assertEqual(routeOf('/proc/0000:0150'), '/proc')
+        self.assertEqual(routeOf('/proc/0000:0150/basic'), '/proc/basic')
+        self.assertEqual(routeOf('/jump/0000:0150?x=1'), '/jump')
+        self.assertEqual(routeOf('/home'), '/home')
+        self.assertEqual(routeOf('/homes'), 'other')
+
+    def testHistogram(self):
+        h = Histogram((0.1, 1.0))
+        for value in (0.05, 0.1, 0.5, 3.0):
+            h.observe(value)
+        self.assertEqual(h.counts, [2, 1, 1])
+        self.assertEqual(h.count, 4)
+
+    def testText(self):
+        out = MetricsText()
+        out.metric('x_total', 'counter', 'Xs.', [({}, 1), (dict(route='/home'), 2)])
+        self.assertEqual(out.text(), '# HELP x_total Xs.\n# TYPE x_total counter\nx_total 1\nx_total{route="/home"} 2\n')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,122 @@
+# This file is part of Awake - GB decompiler.
+# Copyright (C) 2012  Wojciech Marczenko (devdri) <wojtek.marczenko@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import threading
+import time
+import unittest
+from . import address
+from .config import Config
+from .scheduler import AnalysisScheduler, AnalysisError, AnalysisJob, CancelToken, INTERACTIVE, PREFETCH, BULK
+
+class FakeProject(object):
+    def __init__(self):
+        self.config = Config(None)
+
+class FailingProject(FakeProject):
+    """Project whose analyses all fail"""
+    def openCopy(self):
+        self.flow = self
+        return self
+
+    def uncached(self, addr):
+        raise ValueError('bad proc')
+
+    def close(self):
+        pass
+
+class IdleScheduler(AnalysisScheduler):
+    """Scheduler without worker threads, nextProc() is called by the test"""
+    def ensureStarted(self):
+        pass
+
+class Test(unittest.TestCase):
+
+    def setUp(self):
+        self.scheduler = IdleScheduler(FakeProject())
+        self.addrs = [address.fromVirtual(0x100 + 0x10 * i) for i in range(6)]
+
+    def take(self):
+        priority, job, addr = self.scheduler.nextProc()
+        if job:
+            job.running -= 1
+            self.scheduler.bulk_running -= 1
+        elif priority == PREFETCH:
+            self.scheduler.prefetch_running -= 1
+        return priority, addr
+
+    def testPriorities(self):
+        a = self.addrs
+        self.scheduler.submit(AnalysisJob([a[0]]))
+        self.scheduler.prefetch([a[1]])
+        self.scheduler.request(a[2])
+        self.assertEqual(self.take(), (INTERACTIVE, a[2]))
+        self.assertEqual(self.take(), (PREFETCH, a[1]))
+        self.assertEqual(self.take(), (BULK, a[0]))
+
+    def testJobsTakeTurns(self):
+        a = self.addrs
+        self.scheduler.submit(AnalysisJob(a[0:3]))
+        self.scheduler.submit(AnalysisJob(a[3:6]))
+        order = [self.take()[1] for i in range(6)]
+        self.assertEqual(order, [a[0], a[3], a[1], a[4], a[2], a[5]])
+
+    def testCancel(self):
+        a = self.addrs
+        token = CancelToken()
+        job = self.scheduler.submit(AnalysisJob(a[0:3], token=token))
+        self.scheduler.submit(AnalysisJob(a[3:4]))
+        token.cancel()
+        self.assertEqual(self.take(), (BULK, a[3]))
+        self.assertFalse(self.scheduler.waitFor(job, a[0]))
+
+    def testWorkerLeftForInteractive(self):
+        a = self.addrs
+        self.scheduler.num_workers = 2
+        self.scheduler.prefetch(a[0:3])
+        self.scheduler.submit(AnalysisJob(a[3:5]))
+        self.assertEqual(self.scheduler.nextProc()[0], PREFETCH)
+
+        taken = []
+        worker = threading.Thread(target=lambda: taken.append(self.scheduler.nextProc()))
+        worker.daemon = True
+        worker.start()
+        time.sleep(0.05)
+        self.assertEqual(taken, [])  # neither the queued prefetches nor the bulk job take the second worker
+        self.scheduler.request(a[5])
+        worker.join(1)
+        self.assertEqual(taken, [(INTERACTIVE, None, a[5])])
+
+    def testFailure(self):
+        a = self.addrs
+        scheduler = AnalysisScheduler(FailingProject())
+        job = scheduler.submit(AnalysisJob(a[0:2]))
+        try:
+            with self.assertRaises(AnalysisError) as cm:
+                scheduler.waitFor(job, a[0])
+            self.assertEqual(cm.exception.addr, a[0])
+            self.assertIn('bad proc', str(cm.exception))
+        finally:
+            scheduler.stop()
+
+    def testQuiet(self):
+        self.assertTrue(self.scheduler.waitQuiet(0))
+        with self.scheduler.interactive():
+            self.assertFalse(self.scheduler.waitQuiet(0))
+        self.scheduler.request(self.addrs[0])
+        self.assertFalse(self.scheduler.waitQuiet(0))
+
+if __name__ == '__main__':
+    unittest.main()
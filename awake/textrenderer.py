@@ -132,13 +132,51 @@ class Renderer(object):
             self.startNewLine()
             self.write('-'*40)
 
+class ChunkedOutput(object):
+    """
+    Output of a renderer. Kept until getContents(), or given a sink, handed to sink(text) in pieces
+    of about chunk_size characters while rendering. Pieces always end between two writes.
+    """
+
+    def __init__(self, sink=None, chunk_size=16384):
+        self.sink = sink
+        self.chunk_size = chunk_size
+        self.content = []
+        self.buffered = 0
+
+    def write(self, text):
+        self.content.append(text)
+        if self.sink:
+            self.buffered += len(text)
+            if self.buffered >= self.chunk_size:
+                self.flush()
+
+    def getContents(self):
+        """Everything written, or with a sink, what it was not given yet"""
+        return ''.join(self.content)
+
+    def flush(self):
+        if self.sink and self.content:
+            self.sink(''.join(self.content))
+            self.content = []
+            self.buffered = 0
+
 class HtmlRenderer(Renderer):
-    def __init__(self, database):
+    """
+    Renders html. Given a sink, the output goes to sink(text) in pieces while rendering (see ChunkedOutput),
+    call finish() when done. Else use getContents().
+    """
+
+    def __init__(self, database, sink=None, chunk_size=16384):
         super(HtmlRenderer, self).__init__(database)
-        self.content = []
+        self.output = ChunkedOutput(sink, chunk_size)
+        if sink:
+            self.output.write('<pre>')
 
     def getContents(self):
-        return '<pre>' + (''.join(self.content)) + '</pre>'
+        if self.output.sink:
+            return self.output.getContents()
+        return '<pre>' + self.output.getContents() + '</pre>'
 
     def _add(self, text, klass=None, url=None):
         text = str(text)
@@ -146,20 +184,30 @@ class HtmlRenderer(Renderer):
             text = '<span class="{1}">{0}</span>'.format(text, klass)
         if url:
             text = '<a href="{1}">{0}</a>'.format(text, url)
-        self.content.append(text)
+        self.output.write(text)
+
+    def finish(self):
+        self.output.write('</pre>')
+        self.output.flush()
 
 class PlainTextRenderer(Renderer):
-    def __init__(self, database):
+    """
+    Renders just the text, without markup. Given a sink, the output goes to sink(text) in pieces
+    while rendering (see ChunkedOutput), call finish() when done. Else use getContents().
+    """
+
+    def __init__(self, database, sink=None, chunk_size=16384):
         super(PlainTextRenderer, self).__init__(database)
-        self.content = []
+        self.output = ChunkedOutput(sink, chunk_size)
 
     def getContents(self):
-        print(self.content)
-        print([str(x) for x in self.content])
-        return ''.join(self.content)
+        return self.output.getContents()
 
     def _add(self, text, klass=None, url=None):
-        self.content.append(text)
+        self.output.write(text)
+
+    def finish(self):
+        self.output.flush()
 
 class TkRenderer(Renderer):
     def __init__(self, database, tk_text):
@@ -0,0 +1,310 @@
+# This file is part of Awake - GB decompiler.
+# Copyright (C) 2014  Wojciech Marczenko (devdri) <wojtek.marczenko@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Load test for the browsing server: starts ServerTask on localhost against a synthetic rom
+(or a copy of a local one), replays a mix of page visits from concurrent clients
+and prints latency percentiles, throughput and error rates as JSON.
+"""
+
+import argparse
+import contextlib
+import http.client
+import json
+import math
+import os
+import random
+import shutil
+import socket
+import struct
+import tempfile
+import threading
+import time
+from awake.jobs import AnalysisTask
+from awake.project import Project
+from awake.server import ServerTask
+
+# share of the requests going to each kind of page
+DEFAULT_MIX = (
+    ('flow', 0.5),
+    ('basic', 0.15),
+    ('data', 0.1),
+    ('bank', 0.1),
+    ('home', 0.1),
+    ('rename', 0.05),
+)
+
+# procs of the synthetic rom live between these addresses of bank 0
+SYNTHETIC_START = 0x200
+SYNTHETIC_END = 0x3F00
+
+parser = argparse.ArgumentParser(description='Load test the awake server on localhost.')
+parser.add_argument('rom_file', nargs='?', help='rom to browse, a synthetic one is generated if not given')
+parser.add_argument('--procs', type=int, default=200, help='procs in the synthetic rom')
+parser.add_argument('--seed', type=int, default=0)
+parser.add_argument('--concurrency', type=int, default=8, help='clients sending requests at the same time')
+parser.add_argument('--duration', type=float, default=10.0, help='seconds to run')
+parser.add_argument('--threads', type=int, help='server threads, Server/Threads from the config by default')
+parser.add_argument('--output', help='file to write the report to, stdout by default')
+parser.add_argument('--verbose', action='store_true', help='keep the server log')
+
+def makeSyntheticRom(filename, num_procs, seed=0):
+    """
+    Write a 32 KB rom with num_procs small procs in bank 0 that call each other and read and write
+    variables in C000-C0FF, reached from the entry point through a main proc at 0150.
+    Returns the proc addresses.
+    """
+    rng = random.Random(seed)
+    rom = bytearray(0x8000)
+    rom[0x100:0x104] = bytes([0x00, 0xC3, 0x50, 0x01])  # nop; jp 0150
+    rom[0x148] = 0x00  # 32 KB, no mbc
+
+    size = (SYNTHETIC_END - SYNTHETIC_START) // num_procs
+    if size < 32:
+        raise ValueError('too many procs for the synthetic rom')
+    procs = [SYNTHETIC_START + i * size for i in range(num_procs)]
+
+    for i, addr in enumerate(procs):
+        code = bytearray()
+        code += bytes([0x3E, rng.randrange(256)])  # ld a, n
+        code += bytes([0xFE, rng.randrange(256)])  # cp n
+        callees = procs[i + 1:]
+        if callees:
+            code += bytes([0x20, 0x03])  # jr nz, skip the call
+            code += bytes([0xCD]) + struct.pack('<H', rng.choice(callees[:16]))  # call
+        code += bytes([0xEA, rng.randrange(256), 0xC0])  # ld [C0xx], a
+        code += bytes([0xFA, rng.randrange(256), 0xC0])  # ld a, [C0xx]
+        code += bytes([0x3C])  # inc a
+        if len(callees) > 1 and rng.random() < 0.5:
+            code += bytes([0xCD]) + struct.pack('<H', rng.choice(callees[:16]))
+        code += bytes([0xC9])  # ret
+        rom[addr:addr + len(code)] = code
+
+    main = bytearray()
+    for addr in procs[:16]:
+        main += bytes([0xCD]) + struct.pack('<H', addr)
+    main += bytes([0xC9])
+    rom[0x150:0x150 + len(main)] = main
+
+    with open(filename, 'wb') as f:
+        f.write(rom)
+    return procs
+
+def freePort():
+    with contextlib.closing(socket.socket()) as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of sorted values"""
+    if not values:
+        return None
+    return values[max(0, int(math.ceil(fraction * len(values))) - 1)]
+
+def summarize(latencies, errors, duration):
+    latencies = sorted(latencies)
+    count = len(latencies)
+
+    def seconds(value):
+        return round(value, 6) if value is not None else None
+
+    return dict(
+        requests=count,
+        errors=errors,
+        error_rate=round(errors / count, 4) if count else 0.0,
+        throughput=round(count / duration, 2),
+        p50=seconds(percentile(latencies, 0.5)),
+        p95=seconds(percentile(latencies, 0.95)),
+        p99=seconds(percentile(latencies, 0.99)),
+        mean=seconds(sum(latencies) / count if count else None),
+        max=seconds(latencies[-1] if latencies else None),
+    )
+
+class Client(object):
+    """
+    A browser: visits pages from the mix, revalidates pages it saw with their ETag,
+    and polls the flow view of pages still being analyzed like the page script does.
+    """
+
+    def __init__(self, port, procs, banks, seed, deadline, mix=DEFAULT_MIX):
+        self.port = port
+        self.procs = procs
+        self.banks = banks
+        self.rng = random.Random(seed)
+        self.deadline = deadline
+        self.kinds = [kind for kind, _ in mix]
+        self.weights = [weight for _, weight in mix]
+        # popular procs are visited more, like in real browsing
+        self.proc_weights = [1.0 / (rank + 1) for rank in range(len(procs))]
+        self.etags = dict()
+        self.results = []  # (kind, seconds, status), status None on connection errors
+
+    def proc(self):
+        return self.rng.choices(self.procs, self.proc_weights)[0]
+
+    def path(self, kind):
+        if kind == 'flow':
+            return '/proc/{0}'.format(self.proc())
+        elif kind == 'basic':
+            return '/proc/{0}/basic'.format(self.proc())
+        elif kind == 'data':
+            return '/data/0000:C0{0:02X}'.format(self.rng.randrange(256))
+        elif kind == 'bank':
+            return '/bank/{0:02X}'.format(self.rng.choice(self.banks))
+        elif kind == 'home':
+            return '/home'
+        elif kind == 'rename':
+            addr = self.proc()
+            return '/set-name?addr={0}&name=load_{1}'.format(addr, self.rng.randrange(1000))
+
+    def get(self, kind, path):
+        headers = {'Accept-Encoding': 'gzip', 'Referer': 'http://127.0.0.1:{0}/home'.format(self.port)}
+        if path in self.etags:
+            headers['If-None-Match'] = self.etags[path]
+        start = time.perf_counter()
+        try:
+            connection = http.client.HTTPConnection('127.0.0.1', self.port, timeout=60)
+            try:
+                connection.request('GET', path, headers=headers)
+                response = connection.getresponse()
+                response.read()
+            finally:
+                connection.close()
+        except (OSError, http.client.HTTPException):
+            self.results.append((kind, time.perf_counter() - start, None))
+            return None
+        self.results.append((kind, time.perf_counter() - start, response.status))
+        etag = response.getheader('ETag')
+        if etag:
+            self.etags[path] = etag
+        return response
+
+    def run(self):
+        while time.monotonic() < self.deadline:
+            kind = self.rng.choices(self.kinds, self.weights)[0]
+            path = self.path(kind)
+            response = self.get(kind, path)
+            if kind == 'flow' and response is not None and response.status == 200 and not response.getheader('ETag'):
+                # pending page, showing the basic disassembly until the flow is ready
+                while time.monotonic() < self.deadline:
+                    time.sleep(0.2)
+                    response = self.get('flow-poll', path + '/flow')
+                    if response is None or response.status != 202:
+                        break
+
+def runLoadTest(rom_file, procs, concurrency, duration, seed=0, threads=None):
+    """Browse rom_file (whose database already knows procs) with concurrent clients, returns the report"""
+    proj = Project(rom_file, None)
+    port = freePort()
+    task = ServerTask(proj, port)
+    if threads:
+        # ServerTask reads the thread count from the config
+        proj.config.config.setdefault('Server', dict())['Threads'] = threads
+    task.report = lambda *args: None
+    task.start()
+    while task.server is None and not task.isFinished():
+        time.sleep(0.05)
+
+    banks = sorted(set(addr.bank() for addr in procs))
+    deadline = time.monotonic() + duration
+    clients = [Client(port, [str(addr) for addr in procs], banks, seed * 1000 + i, deadline) for i in range(concurrency)]
+    workers = [threading.Thread(target=client.run) for client in clients]
+    start = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - start
+
+    task.stop()
+    while not task.isFinished():
+        time.sleep(0.05)
+    proj.analysisScheduler().stop()
+    proj.close()
+
+    results = [result for client in clients for result in client.results]
+
+    def failed(status):
+        return status is None or status >= 400
+
+    report = dict(
+        rom=os.path.basename(rom_file),
+        procs=len(procs),
+        concurrency=concurrency,
+        duration=round(elapsed, 2),
+        statuses=dict(),
+    )
+    for _, _, status in results:
+        key = str(status) if status is not None else 'error'
+        report['statuses'][key] = report['statuses'].get(key, 0) + 1
+    report.update(summarize([seconds for _, seconds, _ in results], sum(1 for _, _, status in results if failed(status)), elapsed))
+    report['kinds'] = dict()
+    for kind in sorted(set(kind for kind, _, _ in results)):
+        mine = [(seconds, status) for k, seconds, status in results if k == kind]
+        report['kinds'][kind] = summarize([seconds for seconds, _ in mine], sum(1 for _, status in mine if failed(status)), elapsed)
+    return report
+
+def prepare(args, workdir):
+    """Copy or generate the rom in workdir, so the test does not touch the user's database. Returns (rom file, procs)"""
+    if args.rom_file:
+        base = os.path.splitext(args.rom_file)[0]
+        rom_file = os.path.join(workdir, os.path.basename(args.rom_file))
+        shutil.copy(args.rom_file, rom_file)
+        for suffix in ('.awakedb', ):
+            if os.path.exists(base + suffix):
+                shutil.copy(base + suffix, os.path.splitext(rom_file)[0] + suffix)
+        if os.path.exists(args.rom_file + '.json'):
+            shutil.copy(args.rom_file + '.json', rom_file + '.json')
+    else:
+        rom_file = os.path.join(workdir, 'synthetic.gb')
+        makeSyntheticRom(rom_file, args.procs, args.seed)
+
+    proj = Project(rom_file, None)
+    procs = proj.database.getAll()
+    if not procs:
+        # nothing known yet, find the procs reachable from the entry point
+        task = AnalysisTask(proj, 'proc', address='0100', discover=True)
+        task.report = lambda *args: None
+        task.executeSynchronous()
+        procs = proj.database.getAll()
+    proj.analysisScheduler().stop()
+    proj.close()
+    return rom_file, procs
+
+def main():
+    args = parser.parse_args()
+    workdir = tempfile.mkdtemp(prefix='awake-loadtest-')
+    try:
+        with open(os.devnull, 'w') as devnull:
+            quiet = contextlib.ExitStack()
+            if not args.verbose:
+                quiet.enter_context(contextlib.redirect_stdout(devnull))
+                quiet.enter_context(contextlib.redirect_stderr(devnull))
+            with quiet:
+                rom_file, procs = prepare(args, workdir)
+                report = runLoadTest(rom_file, procs, args.concurrency, args.duration, args.seed, args.threads)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    text = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+
+if __name__ == '__main__':
+    main()
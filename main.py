@@ -35,6 +35,7 @@ if __name__ == '__main__':
             task = ServerTask(proj)
             task.report = print
             task.executeSynchronous()
+            proj.analysisScheduler().stop()
         else:
             print("Rom file is required for running server\n")
     else: